@@ -1,22 +1,48 @@
 # app/__init__.py
 
+from app.logs import configure_logging
+
+# Before the other modules load, so nothing logs ahead of the queue handler.
+configure_logging()
+
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from app.main import router as main_router
-from app.database import init_db
+from app.api import router as api_router
+from app.database import init_db, connect_db, close_db, mark_draining
+from app.images import shutdown_image_pool
+from app.like_buffer import start_like_buffer, stop_like_buffer
+from app.hashtags import start_hashtag_refresh, stop_hashtag_refresh
+from app.jobs import start_job_workers, stop_job_workers
+from app.static_assets import CachedStaticFiles
+from app.metrics import RequestMetricsMiddleware
+from app.templating import precompile_templates
 import asyncio
 
 app = FastAPI()
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Per-route latency and MongoDB command counts, exposed on /metrics
+app.add_middleware(RequestMetricsMiddleware)
+
+# Mount static files with long-lived caching for fingerprinted URLs
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 app.include_router(main_router)
+app.include_router(api_router)
 
 @app.on_event("startup")
 async def startup_event():
-    await init_db()
+    # Warming the pool and checking the index manifest overlap.
+    await asyncio.gather(connect_db(), init_db())
+    await start_like_buffer()
+    start_hashtag_refresh()
+    start_job_workers()
+    precompile_templates()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    pass  # Add any shutdown logic if necessary
+    mark_draining()
+    await stop_job_workers()
+    await stop_hashtag_refresh()
+    await stop_like_buffer()
+    await shutdown_image_pool()
+    await close_db()
@@ -0,0 +1,427 @@
+# app/api.py
+
+import hashlib
+import logging
+from datetime import datetime
+from typing import List, Optional, Type
+
+import orjson
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from pydantic import BaseModel
+from starlette.requests import Request
+
+from app.auth import get_current_user, create_access_token
+from app.database import get_database
+from app.hashing import verify_password
+from app.hashtags import hashtag_search_query
+from app.interactions import toggle_like, add_comment, toggle_follow, bulk_follow
+from app.likes import liked_post_ids
+from app.loaders import get_user_loader, attach_usernames
+from app.models import User
+from app.pagination import Page, paginate, cached_count
+from app.schemas import (
+    UserLoginSchema,
+    UserSummarySchema,
+    PostSchema,
+    CommentCreateSchema,
+    CommentSchema,
+    BulkFollowSchema,
+    LikeSchema,
+)
+from app.timeline import read_feed
+from app.user_search import search_usernames
+
+router = APIRouter(prefix="/api/v1", tags=["api"])
+
+logger = logging.getLogger("app.api")
+
+# Fields that are attached from the users collection rather than stored on the document.
+JOINED_FIELDS = {"username", "liked"}
+# Fields every listing query needs for cursors and username lookups.
+REQUIRED_FIELDS = {"_id": 1, "created_at": 1, "user_id": 1}
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError
+
+
+def api_response(request: Request, content, status_code: int = 200) -> Response:
+    """
+    Serializes `content` with orjson and answers conditional GETs: the ETag
+    is a hash of the body, so an unchanged resource costs a 304 and no payload.
+    """
+    body = orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.method == "GET":
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = {tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip() for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+def select_fields(schema: Type[BaseModel], fields: Optional[str]) -> List[str]:
+    """
+    Parses a `fields=a,b,c` parameter against the schema's fields; all fields
+    are returned when it is omitted.
+    """
+    if not fields:
+        return list(schema.__fields__)
+    selected = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in selected if name not in schema.__fields__]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+def projection_for(schema: Type[BaseModel], names: List[str]) -> dict:
+    projection = dict(REQUIRED_FIELDS)
+    for name in names:
+        if name not in JOINED_FIELDS:
+            projection[schema.__fields__[name].alias] = 1
+    return projection
+
+
+def shape(schema: Type[BaseModel], names: List[str], document: dict) -> dict:
+    """
+    Picks the selected schema fields out of a raw document without running
+    model validation on every item.
+    """
+    item = {}
+    for name in names:
+        field = schema.__fields__[name]
+        item[name] = document.get(field.alias, field.default)
+    return item
+
+
+def page_payload(schema: Type[BaseModel], names: List[str], page: Page, **extra) -> dict:
+    return {
+        "items": [shape(schema, names, document) for document in page.items],
+        "has_next": page.has_next,
+        "has_prev": page.has_prev,
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor,
+        **extra,
+    }
+
+
+async def attach_post_fields(request: Request, names: List[str], posts: list, current_user: User):
+    """
+    Fills the requested joined fields: usernames in one batch and the
+    viewer's liked state with one `$in` query for the whole page.
+    """
+    if "username" in names:
+        await attach_usernames(get_user_loader(request), posts)
+    if "liked" in names:
+        liked = await liked_post_ids(get_database(), ObjectId(current_user.id), [post["_id"] for post in posts])
+        for post in posts:
+            post["liked"] = post["_id"] in liked
+
+
+def _object_id(value: str, detail: str) -> ObjectId:
+    if not ObjectId.is_valid(value):
+        raise HTTPException(status_code=404, detail=detail)
+    return ObjectId(value)
+
+
+async def _get_post(db, post_id: str, projection: Optional[dict] = None) -> dict:
+    post = await db.posts.find_one({"_id": _object_id(post_id, "Post not found.")}, projection)
+    if not post:
+        raise HTTPException(status_code=404, detail="Post not found.")
+    return post
+
+
+@router.post("/token")
+async def issue_token(request: Request, credentials: UserLoginSchema):
+    """
+    Exchanges a username and password for a bearer token.
+    """
+    db = get_database()
+    user = await db.users.find_one({"username": credentials.username}, {"password": 1})
+    if not user or not await verify_password(credentials.password, user["password"]):
+        raise HTTPException(status_code=401, detail="Invalid username or password.")
+    access_token = create_access_token(data={"sub": str(user["_id"])})
+    return api_response(request, {"access_token": access_token, "token_type": "bearer"})
+
+
+@router.get("/feed")
+async def api_feed(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated post fields to return"),
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        names = select_fields(PostSchema, fields)
+        page = await read_feed(
+            db, current_user, limit, after=after, before=before, projection=projection_for(PostSchema, names)
+        )
+        await attach_post_fields(request, names, page.items, current_user)
+        return api_response(request, page_payload(PostSchema, names, page))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error fetching API feed: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/posts")
+async def api_list_posts(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated post fields to return"),
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        names = select_fields(PostSchema, fields)
+        page = await paginate(
+            db.posts, {}, limit, after=after, before=before, projection=projection_for(PostSchema, names)
+        )
+        await attach_post_fields(request, names, page.items, current_user)
+        total = await cached_count(db.posts, {})
+        return api_response(request, page_payload(PostSchema, names, page, total=total))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error listing API posts: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/posts/{post_id}")
+async def api_get_post(
+    request: Request,
+    post_id: str,
+    fields: Optional[str] = Query(None, description="Comma-separated post fields to return"),
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    names = select_fields(PostSchema, fields)
+    post = await _get_post(db, post_id, projection_for(PostSchema, names))
+    await attach_post_fields(request, names, [post], current_user)
+    return api_response(request, shape(PostSchema, names, post))
+
+
+@router.get("/posts/{post_id}/likes")
+async def api_post_likes(
+    request: Request,
+    post_id: str,
+    limit: int = Query(10, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated like fields to return"),
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        names = select_fields(LikeSchema, fields)
+        post = await _get_post(db, post_id, {"_id": 1})
+        page = await paginate(
+            db.likes, {"post_id": post["_id"]}, limit, after=after, before=before,
+            projection=projection_for(LikeSchema, names),
+        )
+        if "username" in names:
+            await attach_usernames(get_user_loader(request), page.items)
+        return api_response(request, page_payload(LikeSchema, names, page))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error fetching API post likes: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/posts/{post_id}/comments")
+async def api_post_comments(
+    request: Request,
+    post_id: str,
+    limit: int = Query(10, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated comment fields to return"),
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        names = select_fields(CommentSchema, fields)
+        post = await _get_post(db, post_id, {"_id": 1})
+        page = await paginate(
+            db.comments, {"post_id": post["_id"]}, limit, after=after, before=before,
+            projection=projection_for(CommentSchema, names),
+        )
+        if "username" in names:
+            await attach_usernames(get_user_loader(request), page.items)
+        return api_response(request, page_payload(CommentSchema, names, page))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error fetching API post comments: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/posts/{post_id}/like")
+async def api_like_post(
+    request: Request,
+    post_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        post = await _get_post(db, post_id, {"_id": 1})
+        liked = await toggle_like(db, post, ObjectId(current_user.id))
+        return api_response(request, {"post_id": post["_id"], "liked": liked})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error liking/unliking post via API: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/posts/{post_id}/comments")
+async def api_comment_on_post(
+    request: Request,
+    post_id: str,
+    comment: CommentCreateSchema,
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        post = await _get_post(db, post_id, {"_id": 1})
+        comment_data = await add_comment(db, post, ObjectId(current_user.id), comment.text)
+        comment_data["username"] = current_user.username
+        names = list(CommentSchema.__fields__)
+        return api_response(request, shape(CommentSchema, names, comment_data), status_code=201)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error adding comment via API: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/search/posts")
+async def api_search_posts(
+    request: Request,
+    hashtag: str = Query(..., min_length=1, description="Hashtag to search for (without #)"),
+    category: Optional[str] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated post fields to return"),
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        names = select_fields(PostSchema, fields)
+        query = hashtag_search_query(hashtag, category, start_date, end_date)
+        page = await paginate(
+            db.posts, query, limit, after=after, before=before, projection=projection_for(PostSchema, names)
+        )
+        await attach_post_fields(request, names, page.items, current_user)
+        return api_response(request, page_payload(PostSchema, names, page))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error searching posts via API: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/search/users")
+async def api_search_users(
+    request: Request,
+    q: str = Query(..., min_length=1, description="Search query for usernames"),
+    limit: int = Query(10, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    before: Optional[str] = Query(None),
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        page = await search_usernames(db, q, limit, after=after, before=before)
+        return api_response(request, page_payload(UserSummarySchema, list(UserSummarySchema.__fields__), page))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error searching users via API: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/users/{user_id}/follow")
+async def api_follow_user(
+    request: Request,
+    user_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    db = get_database()
+    try:
+        if str(current_user.id) == user_id:
+            raise HTTPException(status_code=400, detail="You cannot follow yourself.")
+        target_user = await db.users.find_one(
+            {"_id": _object_id(user_id, "User not found.")},
+            {"username": 1, "followers_count": 1, "fanout_mode": 1},
+        )
+        if not target_user:
+            raise HTTPException(status_code=404, detail="User not found.")
+        following = await toggle_follow(db, ObjectId(current_user.id), target_user)
+        return api_response(request, {"user_id": target_user["_id"], "following": following})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error following/unfollowing user via API: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/users/follow")
+async def api_bulk_follow(
+    request: Request,
+    changes: BulkFollowSchema,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Follows and unfollows a list of users in one call, e.g. for onboarding
+    suggestions. All targets are validated with a single `$in` query; unknown
+    ids are reported back rather than failing the request.
+    """
+    db = get_database()
+    try:
+        follow_ids = list(dict.fromkeys(changes.follow))
+        unfollow_ids = list(dict.fromkeys(changes.unfollow))
+        if set(follow_ids) & set(unfollow_ids):
+            raise HTTPException(status_code=400, detail="A user cannot be both followed and unfollowed.")
+        if str(current_user.id) in follow_ids:
+            raise HTTPException(status_code=400, detail="You cannot follow yourself.")
+        requested = [user_id for user_id in follow_ids + unfollow_ids if ObjectId.is_valid(user_id)]
+        cursor = db.users.find(
+            {"_id": {"$in": [ObjectId(user_id) for user_id in requested]}},
+            {"username": 1, "followers_count": 1, "fanout_mode": 1},
+        )
+        users = {str(user["_id"]): user async for user in cursor}
+        followed, unfollowed = await bulk_follow(
+            db,
+            ObjectId(current_user.id),
+            [users[user_id] for user_id in follow_ids if user_id in users],
+            [users[user_id]["_id"] for user_id in unfollow_ids if user_id in users],
+        )
+        changed = {str(user_id) for user_id in followed + unfollowed}
+        return api_response(request, {
+            "followed": followed,
+            "unfollowed": unfollowed,
+            "unchanged": [user_id for user_id in users if user_id not in changed],
+            "not_found": [user_id for user_id in follow_ids + unfollow_ids if user_id not in users],
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error bulk following users via API: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
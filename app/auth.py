@@ -1,5 +1,6 @@
 # app/auth.py
 
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -8,7 +9,9 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from bson import ObjectId
 
+from app.cache import TTLCache
 from app.database import get_database
+from app.follows import LEGACY_ARRAYS
 from app.models import User
 
 # Secret key to encode JWT tokens
@@ -18,6 +21,19 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+# Authenticated users keyed by token subject, so most requests skip the users lookup
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "30")),
+)
+
+
+def invalidate_cached_user(user_id):
+    """
+    Drops a user from the authentication cache after their document changes.
+    """
+    user_cache.invalidate(str(user_id))
+
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -32,6 +48,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 async def get_current_user(request: Request) -> User:
     token = request.cookies.get("token")
+    if not token:
+        # API clients send the token in an Authorization: Bearer header instead
+        scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials.strip()
     if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,12 +74,18 @@ async def get_current_user(request: Request) -> User:
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
     db = get_database()
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    # Follow edges live in their own collection; never load legacy arrays here.
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, LEGACY_ARRAYS)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return User(**user)
+    current_user = User(**user)
+    user_cache.set(user_id, current_user)
+    return current_user
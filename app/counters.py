@@ -0,0 +1,77 @@
+# app/counters.py
+
+import asyncio
+import logging
+
+from pymongo import UpdateOne
+
+from app.database import get_database
+
+logger = logging.getLogger("app.counters")
+
+# Number of post updates sent to MongoDB per bulk_write call.
+RECONCILE_BATCH_SIZE = 1000
+
+
+async def increment_post_counter(db, post_id, field: str, amount: int = 1):
+    """
+    Atomically adjusts a denormalized counter (likes_count / comments_count)
+    on a post document.
+    """
+    await db.posts.update_one({"_id": post_id}, {"$inc": {field: amount}})
+
+
+async def _count_by_post(collection) -> dict:
+    pipeline = [{"$group": {"_id": "$post_id", "count": {"$sum": 1}}}]
+    counts = {}
+    async for row in collection.aggregate(pipeline):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+
+async def reconcile_post_counters(db=None) -> int:
+    """
+    Rebuilds likes_count and comments_count on every post from the likes and
+    comments collections. Returns the number of posts whose counters changed.
+
+    Counter shards are folded before counting, so the recount supersedes
+    them. Likes flushed while it runs can still be counted twice or not at
+    all; run it with the like buffers idle, or again, for exact counts.
+    """
+    # Imported here: app.like_buffer imports this module.
+    from app.like_buffer import fold_counter_shards
+
+    db = db if db is not None else get_database()
+    await fold_counter_shards(db)
+    likes = await _count_by_post(db.likes)
+    comments = await _count_by_post(db.comments)
+
+    updated = 0
+    operations = []
+    projection = {"likes_count": 1, "comments_count": 1}
+    async for post in db.posts.find({}, projection):
+        likes_count = likes.get(post["_id"], 0)
+        comments_count = comments.get(post["_id"], 0)
+        if post.get("likes_count") == likes_count and post.get("comments_count") == comments_count:
+            continue
+        operations.append(
+            UpdateOne(
+                {"_id": post["_id"]},
+                {"$set": {"likes_count": likes_count, "comments_count": comments_count}},
+            )
+        )
+        if len(operations) >= RECONCILE_BATCH_SIZE:
+            result = await db.posts.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+            operations = []
+    if operations:
+        result = await db.posts.bulk_write(operations, ordered=False)
+        updated += result.modified_count
+    # Only shards still at zero are removed; later increments are left for the next fold.
+    await db.like_counter_shards.delete_many({"likes_count": 0})
+    logger.info("Reconciled post counters: %s posts updated.", updated)
+    return updated
+
+
+if __name__ == "__main__":
+    asyncio.run(reconcile_post_counters())
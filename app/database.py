@@ -1,44 +1,357 @@
 # app/database.py
 
 import os
+import json
+import time
+import hashlib
+import asyncio
 import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+from pymongo.monitoring import ConnectionPoolListener
 
 from dotenv import load_dotenv
 
+from app.metrics import command_metrics
+
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "instagram")
+# Connection pool bounds per worker process. Idle connections above the
+# minimum are closed after MONGO_MAX_IDLE_TIME_MS.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = os.getenv("MONGO_MAX_IDLE_TIME_MS")
+# Timeouts in milliseconds; unset ones keep the driver defaults.
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = os.getenv("MONGO_SOCKET_TIMEOUT_MS")
+MONGO_WAIT_QUEUE_TIMEOUT_MS = os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS")
+# Wire compression, e.g. "zstd,snappy,zlib" (zstd and snappy need their extra packages).
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+# Read / write concerns and read preference, e.g. "majority", "1", "secondaryPreferred".
+MONGO_READ_CONCERN = os.getenv("MONGO_READ_CONCERN")
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE")
+# Concurrent pings sent at startup so that many connections are open before
+# the worker reports ready.
+MONGO_WARM_CONNECTIONS = int(os.getenv("MONGO_WARM_CONNECTIONS", str(MONGO_MIN_POOL_SIZE)))
+
+# Index provisioning at startup: "auto" applies INDEX_MANIFEST when its
+# version differs from the one recorded in the database, "always" applies it
+# on every start and "off" leaves indexes to a separate deploy step.
+INDEX_SYNC = os.getenv("INDEX_SYNC", "auto").lower()
+DUPLICATE_KEY = 11000
 
-client = AsyncIOMotorClient(MONGO_URI)
-db = client[DATABASE_NAME]
+# Every index the app relies on, by collection. Changing anything here
+# changes manifest_version(), and the next worker to start applies it.
+INDEX_MANIFEST = {
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        # Username search: prefix range scans and n-gram substring lookups (see app/user_search.py)
+        IndexModel([("username_lower", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("username_ngrams", ASCENDING), ("username_lower", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("fanout_mode", ASCENDING)], sparse=True),
+        IndexModel([("followers_count", DESCENDING)]),
+    ],
+    "posts": [
+        # Cursor pagination sorts on (created_at, _id), so both are part of the key;
+        # hashtag and category searches filter on an equality field first
+        IndexModel([("hashtags", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("category", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        # Posts whose follow-up jobs have not been relayed yet (see app/jobs.py)
+        IndexModel([("outbox.key", ASCENDING)], sparse=True),
+    ],
+    "likes": [
+        IndexModel([("post_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING)]),
+        # One like per (post, user); existing duplicates must be removed first (see app/likes.py)
+        IndexModel([("post_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+    ],
+    "comments": [
+        IndexModel([("post_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    # Materialized home timelines (see app/timeline.py)
+    "timelines": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("post_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("post_id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("author_id", ASCENDING)]),
+    ],
+    # Like counters for hot posts, folded into posts.likes_count (see app/like_buffer.py)
+    "like_counter_shards": [
+        IndexModel([("post_id", ASCENDING), ("shard", ASCENDING)], unique=True),
+    ],
+    # Follow graph edges (see app/follows.py)
+    "follows": [
+        IndexModel([("follower_id", ASCENDING), ("followee_id", ASCENDING)], unique=True),
+        IndexModel([("followee_id", ASCENDING), ("follower_id", ASCENDING)]),
+    ],
+    # Hashtag statistics (see app/hashtags.py)
+    "hashtag_stats": [
+        IndexModel([("count", DESCENDING)]),
+    ],
+    # Background jobs, keyed by idempotency key (see app/jobs.py)
+    "jobs": [
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "hashtag_buckets": [
+        IndexModel([("tag", ASCENDING), ("bucket", ASCENDING)], unique=True),
+        IndexModel([("bucket", ASCENDING)], expireAfterSeconds=8 * 24 * 3600),
+    ],
+}
+# How to clear duplicates that block a unique index, by collection.
+DEDUPE_COMMANDS = {"likes": "python -m app.likes dedupe"}
+
+client: Optional[AsyncIOMotorClient] = None
+db = None
+# False until the pool has been warmed, and again once shutdown starts,
+# so /readyz takes the worker out of rotation while it is cold or draining.
+ready = False
 
 logger = logging.getLogger("app.database")
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
-
-async def init_db():
-    # Create indexes
-    await db.users.create_index([("username", ASCENDING)], unique=True)
-    await db.users.create_index([("email", ASCENDING)], unique=True)
-    await db.posts.create_index([("hashtags", ASCENDING)])
-    await db.posts.create_index([("category", ASCENDING)])
-    await db.posts.create_index([("created_at", DESCENDING)])
-    await db.posts.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
-    await db.likes.create_index([("post_id", ASCENDING)])
-    await db.likes.create_index([("user_id", ASCENDING)])
-    await db.comments.create_index([("post_id", ASCENDING)])
-    await db.comments.create_index([("user_id", ASCENDING)])
-    logger.info("All indexes created successfully.")
 
 
-def get_database():
+class PoolStats(ConnectionPoolListener):
+    """
+    Counts connection pool events. The driver calls these from its own
+    threads, so updates take a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.created = 0
+        self.closed = 0
+        self.checkout_failures = 0
+        self.pools_cleared = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pools_cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": MONGO_MAX_POOL_SIZE,
+                "min_size": MONGO_MIN_POOL_SIZE,
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "waiting": self.waiting,
+                "utilization": self.checked_out / MONGO_MAX_POOL_SIZE if MONGO_MAX_POOL_SIZE else 0.0,
+                "created": self.created,
+                "closed": self.closed,
+                "checkout_failures": self.checkout_failures,
+                "pools_cleared": self.pools_cleared,
+            }
+
+
+pool_stats = PoolStats()
+
+
+def _client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [pool_stats, command_metrics],
+    }
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = int(MONGO_MAX_IDLE_TIME_MS)
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = int(MONGO_SOCKET_TIMEOUT_MS)
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = int(MONGO_WAIT_QUEUE_TIMEOUT_MS)
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    if MONGO_READ_CONCERN:
+        options["readConcernLevel"] = MONGO_READ_CONCERN
+    if MONGO_WRITE_CONCERN:
+        options["w"] = int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+    if MONGO_READ_PREFERENCE:
+        options["readPreference"] = MONGO_READ_PREFERENCE
+    return options
+
+
+def manifest_version() -> str:
+    """
+    Short hash of INDEX_MANIFEST. Key order is kept, since it is part of
+    an index's definition.
+    """
+    specs = [
+        [collection, list(index.document["key"].items()), sorted((k, v) for k, v in index.document.items() if k != "key")]
+        for collection, indexes in INDEX_MANIFEST.items()
+        for index in indexes
+    ]
+    return hashlib.sha256(json.dumps(specs, default=str).encode()).hexdigest()[:12]
+
+
+def connect():
+    """
+    Creates the client if there is none yet. Called at startup, and lazily by
+    get_database() for the command-line jobs that never run the app.
+    """
+    global client, db
+    if db is None:
+        client = AsyncIOMotorClient(MONGO_URI, **_client_options())
+        db = client[DATABASE_NAME]
     return db
+
+
+async def ping() -> float:
+    """
+    Round-trips a ping to the server and returns the latency in milliseconds.
+    """
+    started = time.perf_counter()
+    await get_database().command("ping")
+    return (time.perf_counter() - started) * 1000
+
+
+async def connect_db():
+    """
+    Creates the client and opens MONGO_WARM_CONNECTIONS connections with
+    concurrent pings, so the first requests after a deploy don't pay for
+    connection setup.
+    """
+    global ready
+    connect()
+    latencies = await asyncio.gather(*(ping() for _ in range(max(MONGO_WARM_CONNECTIONS, 1))))
+    ready = True
+    logger.info(
+        "MongoDB pool warmed: %s connections open, ping %.1f-%.1f ms.",
+        pool_stats.open,
+        min(latencies),
+        max(latencies),
+    )
+
+
+def mark_draining():
+    """
+    Fails /readyz from the start of shutdown, while buffers are still being
+    flushed, so the load balancer stops sending new requests.
+    """
+    global ready
+    ready = False
+
+
+async def close_db():
+    global client, db, ready
+    ready = False
+    if db is not None:
+        db.client.close()
+    client = None
+    db = None
+    logger.info("MongoDB client closed.")
+
+
+async def health(check_server: bool) -> dict:
+    """
+    Pool utilization for /healthz and /readyz, plus a fresh ping round trip
+    when `check_server` is set.
+    """
+    status = {"ready": ready, "pool": pool_stats.snapshot()}
+    if check_server:
+        try:
+            status["ping_ms"] = round(await ping(), 3)
+        except PyMongoError as e:
+            status["ready"] = False
+            status["error"] = str(e)
+    return status
+
+
+async def _create_collection_indexes(db, collection: str, indexes: list) -> bool:
+    """
+    Creates one collection's indexes in a single createIndexes command.
+    Returns False if a unique index could not be built because of existing
+    duplicates; the collection's other indexes are still created.
+    """
+    try:
+        await db[collection].create_indexes(indexes)
+        return True
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        hint = DEDUPE_COMMANDS.get(collection, "remove the duplicates")
+        logger.error("Duplicate %s prevent a unique index; run '%s'.", collection, hint)
+        await db[collection].create_indexes([index for index in indexes if not index.document.get("unique")])
+        return False
+
+
+async def init_db(force: bool = False):
+    """
+    Applies INDEX_MANIFEST, one createIndexes command per collection, all
+    collections concurrently. Skipped when the database already records the
+    current manifest version, so a normal worker start costs one find_one.
+    """
+    db = get_database()
+    if INDEX_SYNC == "off":
+        return
+    version = manifest_version()
+    if not force and INDEX_SYNC != "always":
+        applied = await db.meta.find_one({"_id": "indexes"}, {"version": 1})
+        if applied and applied.get("version") == version:
+            logger.info("Indexes are up to date (manifest %s).", version)
+            return
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(_create_collection_indexes(db, collection, indexes) for collection, indexes in INDEX_MANIFEST.items())
+    )
+    if all(results):
+        # Left unrecorded otherwise, so the next start retries the missing index.
+        await db.meta.update_one(
+            {"_id": "indexes"},
+            {"$set": {"version": version, "applied_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    logger.info("Applied index manifest %s in %.2fs.", version, time.perf_counter() - started)
+
+
+def get_database():
+    return db if db is not None else connect()
@@ -0,0 +1,265 @@
+# app/follows.py
+
+import os
+import sys
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from app.database import get_database
+
+logger = logging.getLogger("app.follows")
+
+# Follow edges are stored one document per relationship:
+# {follower_id, followee_id, created_at}, unique on (follower_id, followee_id).
+FOLLOWER_BATCH_SIZE = 1000
+MIGRATION_BATCH_SIZE = 1000
+# Fields that used to hold the follow graph inside the user document.
+LEGACY_ARRAYS = {"following": 0, "followers": 0}
+# Whether follow / unfollow writes use a multi-document transaction: "auto"
+# uses one when the deployment supports it (replica set or sharded cluster).
+FOLLOW_TRANSACTIONS = os.getenv("FOLLOW_TRANSACTIONS", "auto").lower()
+# Most accounts a single bulk follow / unfollow request may name.
+BULK_FOLLOW_LIMIT = int(os.getenv("BULK_FOLLOW_LIMIT", "100"))
+# Server error code for "Transaction numbers are only allowed on a replica set member or mongos".
+ILLEGAL_OPERATION = 20
+
+_transactions_supported = FOLLOW_TRANSACTIONS not in ("0", "false", "off", "no")
+
+
+async def is_following(db, follower_id, followee_id) -> bool:
+    edge = await db.follows.find_one(
+        {"follower_id": follower_id, "followee_id": followee_id}, {"_id": 1}
+    )
+    return edge is not None
+
+
+def _count_updates(follower_id, followee_ids: list, delta: int) -> list:
+    return [
+        UpdateOne({"_id": follower_id}, {"$inc": {"following_count": delta * len(followee_ids)}}),
+        UpdateMany({"_id": {"$in": followee_ids}}, {"$inc": {"followers_count": delta}}),
+    ]
+
+
+async def _recount(db, user_ids: list, session=None):
+    """
+    Recomputes the cached counts of a few users from the edges.
+    """
+    operations = []
+    for user_id in user_ids:
+        followers_count = await db.follows.count_documents({"followee_id": user_id}, session=session)
+        following_count = await db.follows.count_documents({"follower_id": user_id}, session=session)
+        operations.append(UpdateOne(
+            {"_id": user_id},
+            {"$set": {"followers_count": followers_count, "following_count": following_count}},
+        ))
+    if operations:
+        await db.users.bulk_write(operations, ordered=True, session=session)
+
+
+async def _run_write(db, operation):
+    """
+    Runs `operation(session)` in a multi-document transaction, so the edges
+    and both sides' counts change together. Deployments without transactions
+    (a standalone mongod) run it with session=None instead; each side is then
+    one ordered bulk write and `python -m app.follows reconcile` repairs the
+    counts if a request dies in between.
+    """
+    global _transactions_supported
+    if _transactions_supported:
+        try:
+            async with await db.client.start_session() as session:
+                return await session.with_transaction(operation)
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION:
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB does not support transactions here; follow writes will not use them.")
+    return await operation(None)
+
+
+async def follow_many(db, follower_id, followee_ids) -> list:
+    """
+    Creates follow edges to each of `followee_ids` and bumps the cached counts
+    on both sides. Returns the ids that were not already followed.
+    """
+    followee_ids = [followee_id for followee_id in dict.fromkeys(followee_ids) if followee_id != follower_id]
+    if not followee_ids:
+        return []
+
+    async def operation(session):
+        now = datetime.utcnow()
+        edges = [
+            UpdateOne(
+                {"follower_id": follower_id, "followee_id": followee_id},
+                {"$setOnInsert": {"created_at": now}},
+                upsert=True,
+            )
+            for followee_id in followee_ids
+        ]
+        try:
+            result = await db.follows.bulk_write(edges, ordered=False, session=session)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # Without a transaction, a concurrent follow of the same account can
+            # win the unique index race; that edge simply isn't ours to count.
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            upserted = {upsert["index"]: upsert["_id"] for upsert in e.details["upserted"]}
+        created = [followee_ids[index] for index in sorted(upserted)]
+        if created:
+            await db.users.bulk_write(_count_updates(follower_id, created, 1), ordered=True, session=session)
+        return created
+
+    return await _run_write(db, operation)
+
+
+async def unfollow_many(db, follower_id, followee_ids) -> list:
+    """
+    Removes the follow edges to each of `followee_ids` and decrements the
+    cached counts on both sides. Returns the ids that were followed before.
+    """
+    followee_ids = list(dict.fromkeys(followee_ids))
+    if not followee_ids:
+        return []
+
+    async def operation(session):
+        cursor = db.follows.find(
+            {"follower_id": follower_id, "followee_id": {"$in": followee_ids}},
+            {"followee_id": 1},
+            session=session,
+        )
+        edges = await cursor.to_list(length=None)
+        if not edges:
+            return []
+        result = await db.follows.delete_many({"_id": {"$in": [edge["_id"] for edge in edges]}}, session=session)
+        removed = [edge["followee_id"] for edge in edges]
+        if result.deleted_count == len(edges):
+            await db.users.bulk_write(_count_updates(follower_id, removed, -1), ordered=True, session=session)
+        else:
+            # A concurrent unfollow deleted some of the edges first (only
+            # possible without a transaction), so count from the edges instead.
+            await _recount(db, [follower_id] + removed, session)
+        return removed
+
+    return await _run_write(db, operation)
+
+
+async def follow(db, follower_id, followee_id) -> bool:
+    """
+    Creates a follow edge and bumps the cached counts. Returns False if the
+    edge already existed.
+    """
+    return bool(await follow_many(db, follower_id, [followee_id]))
+
+
+async def unfollow(db, follower_id, followee_id) -> bool:
+    """
+    Removes a follow edge and decrements the cached counts. Returns False if
+    there was no edge.
+    """
+    return bool(await unfollow_many(db, follower_id, [followee_id]))
+
+
+async def followed_among(db, follower_id, candidate_ids) -> list:
+    """
+    Returns the subset of `candidate_ids` that `follower_id` follows.
+    """
+    if not candidate_ids:
+        return []
+    cursor = db.follows.find(
+        {"follower_id": follower_id, "followee_id": {"$in": list(candidate_ids)}},
+        {"followee_id": 1, "_id": 0},
+    )
+    return [edge["followee_id"] async for edge in cursor]
+
+
+async def follower_id_batches(db, followee_id, batch_size: int = FOLLOWER_BATCH_SIZE):
+    """
+    Yields the ids of an account's followers in batches, so fan-out never
+    holds a celebrity's whole follower list in memory.
+    """
+    batch = []
+    cursor = db.follows.find({"followee_id": followee_id}, {"follower_id": 1, "_id": 0})
+    async for edge in cursor.batch_size(batch_size):
+        batch.append(edge["follower_id"])
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def reconcile_follow_counts(db=None) -> int:
+    """
+    Recomputes followers_count / following_count on every user from the edges.
+    """
+    db = db if db is not None else get_database()
+    counts = {}
+    for field, key in (("followers_count", "$followee_id"), ("following_count", "$follower_id")):
+        async for row in db.follows.aggregate([{"$group": {"_id": key, "count": {"$sum": 1}}}]):
+            counts.setdefault(row["_id"], {"followers_count": 0, "following_count": 0})[field] = row["count"]
+    updated = 0
+    operations = []
+    async for user in db.users.find({}, {"_id": 1}):
+        values = counts.get(user["_id"], {"followers_count": 0, "following_count": 0})
+        operations.append(UpdateOne({"_id": user["_id"]}, {"$set": values}))
+        if len(operations) >= MIGRATION_BATCH_SIZE:
+            updated += (await db.users.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await db.users.bulk_write(operations, ordered=False)).modified_count
+    logger.info("Reconciled follow counts on %s users.", updated)
+    return updated
+
+
+async def migrate_follow_arrays(db=None) -> int:
+    """
+    Streams the legacy `following` / `followers` arrays into the follows
+    collection, recomputes the cached counts and then removes the arrays.
+    Safe to re-run: edges are upserted.
+    """
+    db = db if db is not None else get_database()
+    created = 0
+    operations = []
+
+    async def flush():
+        nonlocal created, operations
+        if operations:
+            created += (await db.follows.bulk_write(operations, ordered=False)).upserted_count
+            operations = []
+
+    now = datetime.utcnow()
+    query = {"$or": [{"following.0": {"$exists": True}}, {"followers.0": {"$exists": True}}]}
+    async for user in db.users.find(query, {"following": 1, "followers": 1}):
+        # Both sides are read so edges recorded on only one side are not lost.
+        pairs = [(user["_id"], followee_id) for followee_id in user.get("following", [])]
+        pairs += [(follower_id, user["_id"]) for follower_id in user.get("followers", [])]
+        for follower_id, followee_id in pairs:
+            if follower_id == followee_id:
+                continue
+            operations.append(UpdateOne(
+                {"follower_id": follower_id, "followee_id": followee_id},
+                {"$setOnInsert": {"created_at": now}},
+                upsert=True,
+            ))
+            if len(operations) >= MIGRATION_BATCH_SIZE:
+                await flush()
+    await flush()
+    await reconcile_follow_counts(db)
+    await db.users.update_many(
+        {"$or": [{"following": {"$exists": True}}, {"followers": {"$exists": True}}]},
+        {"$unset": {"following": "", "followers": ""}},
+    )
+    logger.info("Migrated follow arrays: %s edges created.", created)
+    return created
+
+
+if __name__ == "__main__":
+    commands = {"migrate": migrate_follow_arrays, "reconcile": reconcile_follow_counts}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit("usage: python -m app.follows migrate|reconcile")
+    asyncio.run(commands[sys.argv[1]]())
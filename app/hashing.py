@@ -0,0 +1,87 @@
+# app/hashing.py
+
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException
+
+# bcrypt cost factor for new hashes; existing hashes keep the cost they were made with.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads dedicated to hashing. bcrypt releases the GIL, so these run in parallel.
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash operations allowed to wait or run at once before new ones are shed with a 503.
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+_metrics = {
+    "pending": 0,
+    "peak_pending": 0,
+    "completed": 0,
+    "rejected": 0,
+    "wait_seconds_total": 0.0,
+    "hash_seconds_total": 0.0,
+    "hash_seconds_max": 0.0,
+}
+
+
+def _timed(func, queued_at: float, *args):
+    started_at = time.perf_counter()
+    result = func(*args)
+    return result, started_at - queued_at, time.perf_counter() - started_at
+
+
+async def _run(func, *args):
+    if _metrics["pending"] >= BCRYPT_MAX_PENDING:
+        _metrics["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-in requests, please try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+    _metrics["pending"] += 1
+    _metrics["peak_pending"] = max(_metrics["peak_pending"], _metrics["pending"])
+    try:
+        loop = asyncio.get_running_loop()
+        result, waited, took = await loop.run_in_executor(
+            _executor, _timed, func, time.perf_counter(), *args
+        )
+    finally:
+        _metrics["pending"] -= 1
+    _metrics["completed"] += 1
+    _metrics["wait_seconds_total"] += waited
+    _metrics["hash_seconds_total"] += took
+    _metrics["hash_seconds_max"] = max(_metrics["hash_seconds_max"], took)
+    return result
+
+
+def _hash(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run(_verify, plain_password, hashed_password)
+
+
+def hashing_stats() -> dict:
+    completed = _metrics["completed"]
+    return {
+        "workers": BCRYPT_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "max_pending": BCRYPT_MAX_PENDING,
+        **_metrics,
+        "hash_seconds_avg": _metrics["hash_seconds_total"] / completed if completed else 0.0,
+        "wait_seconds_avg": _metrics["wait_seconds_total"] / completed if completed else 0.0,
+    }
@@ -0,0 +1,219 @@
+# app/hashtags.py
+
+import os
+import sys
+import asyncio
+import bisect
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import UpdateOne
+from starlette.concurrency import run_in_threadpool
+
+from app.database import get_database
+
+logger = logging.getLogger("app.hashtags")
+
+# How often each worker reloads its in-memory hashtag index, in seconds.
+REFRESH_INTERVAL = float(os.getenv("HASHTAG_REFRESH_SECONDS", "30"))
+# Number of most-used hashtags kept in memory for autocomplete.
+INDEX_SIZE = int(os.getenv("HASHTAG_INDEX_SIZE", "100000"))
+# Hourly buckets older than this are removed by a TTL index.
+BUCKET_RETENTION = timedelta(days=8)
+# Time windows offered by the "top hashtags" view.
+WINDOWS = {"24h": timedelta(hours=24), "7d": timedelta(days=7)}
+# Prefixes up to this length have their suggestions precomputed on refresh.
+PRECOMPUTED_PREFIX_LENGTH = 2
+TOP_SIZE = 100
+SUGGESTION_SIZE = 10
+
+
+def _bucket(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+async def record_hashtags(db, hashtags: List[str], created_at: datetime):
+    """
+    Incrementally updates the all-time and hourly hashtag counters for a new post.
+    """
+    tags = list(dict.fromkeys(tag for tag in hashtags if tag))
+    if not tags:
+        return
+    bucket = _bucket(created_at)
+    await db.hashtag_stats.bulk_write(
+        [
+            UpdateOne(
+                {"_id": tag},
+                {"$inc": {"count": 1}, "$max": {"last_used_at": created_at}},
+                upsert=True,
+            )
+            for tag in tags
+        ],
+        ordered=False,
+    )
+    await db.hashtag_buckets.bulk_write(
+        [
+            UpdateOne({"tag": tag, "bucket": bucket}, {"$inc": {"count": 1}}, upsert=True)
+            for tag in tags
+        ],
+        ordered=False,
+    )
+
+
+def hashtag_search_query(
+    hashtag: str,
+    category: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> dict:
+    """
+    Posts query for a hashtag search with optional category and date filters.
+    """
+    query = {"hashtags": {"$in": [hashtag.lower()]}}
+    if category:
+        query["category"] = category
+    if start_date and end_date:
+        query["created_at"] = {"$gte": start_date, "$lte": end_date}
+    elif start_date:
+        query["created_at"] = {"$gte": start_date}
+    elif end_date:
+        query["created_at"] = {"$lte": end_date}
+    return query
+
+
+class HashtagIndex:
+    """
+    Immutable snapshot of hashtag counts used for autocomplete and top lists.
+    A new snapshot is built off the event loop and swapped in on refresh.
+    """
+
+    def __init__(self, counts: Optional[dict] = None, windows: Optional[dict] = None):
+        self.counts = counts or {}
+        self.names = sorted(self.counts)
+        self.top = {"all": heapq.nlargest(TOP_SIZE, self.counts.items(), key=lambda item: item[1])}
+        self.top.update(windows or {})
+        self.prefixes = {}
+        for name in self.names:
+            for length in range(1, min(len(name), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                self.prefixes.setdefault(name[:length], []).append(name)
+        for prefix, names in self.prefixes.items():
+            self.prefixes[prefix] = heapq.nlargest(SUGGESTION_SIZE, names, key=self.counts.__getitem__)
+
+    def suggest(self, prefix: str, limit: int = SUGGESTION_SIZE) -> List[tuple]:
+        prefix = prefix.lower().lstrip("#")
+        if not prefix:
+            return self.top["all"][:limit]
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH and limit <= SUGGESTION_SIZE:
+            names = self.prefixes.get(prefix, [])[:limit]
+        else:
+            start = bisect.bisect_left(self.names, prefix)
+            end = bisect.bisect_left(self.names, prefix + "\uffff", lo=start)
+            names = heapq.nlargest(limit, self.names[start:end], key=self.counts.__getitem__)
+        return [(name, self.counts[name]) for name in names]
+
+    def top_hashtags(self, window: str = "all", limit: int = TOP_SIZE) -> List[tuple]:
+        return self.top.get(window, [])[:limit]
+
+
+hashtag_index = HashtagIndex()
+_refresh_task = None
+
+
+async def _load_window(db, since: datetime) -> List[tuple]:
+    pipeline = [
+        {"$match": {"bucket": {"$gte": since}}},
+        {"$group": {"_id": "$tag", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": -1}},
+        {"$limit": TOP_SIZE},
+    ]
+    return [(row["_id"], row["count"]) async for row in db.hashtag_buckets.aggregate(pipeline)]
+
+
+async def refresh_hashtag_index(db=None) -> HashtagIndex:
+    global hashtag_index
+    db = db if db is not None else get_database()
+    cursor = db.hashtag_stats.find({}, {"count": 1}).sort("count", -1).limit(INDEX_SIZE)
+    counts = {row["_id"]: row["count"] async for row in cursor}
+    now = datetime.utcnow()
+    windows = {name: await _load_window(db, now - span) for name, span in WINDOWS.items()}
+    hashtag_index = await run_in_threadpool(HashtagIndex, counts, windows)
+    return hashtag_index
+
+
+def get_hashtag_index() -> HashtagIndex:
+    return hashtag_index
+
+
+async def _refresh_forever():
+    while True:
+        try:
+            await refresh_hashtag_index()
+        except Exception as e:
+            logger.error("Error refreshing hashtag index: %s", e)
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+
+def start_hashtag_refresh():
+    global _refresh_task
+    if _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_forever())
+
+
+async def stop_hashtag_refresh():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+
+
+async def rebuild_hashtag_stats(db=None) -> int:
+    """
+    Recomputes hashtag_stats and the recent hourly buckets from the posts collection.
+    """
+    db = db if db is not None else get_database()
+    totals = db.posts.aggregate([
+        {"$unwind": "$hashtags"},
+        {"$group": {"_id": "$hashtags", "count": {"$sum": 1}, "last_used_at": {"$max": "$created_at"}}},
+    ])
+    operations = [
+        UpdateOne({"_id": row["_id"]}, {"$set": {"count": row["count"], "last_used_at": row["last_used_at"]}}, upsert=True)
+        async for row in totals
+    ]
+    if operations:
+        await db.hashtag_stats.bulk_write(operations, ordered=False)
+    since = _bucket(datetime.utcnow() - BUCKET_RETENTION)
+    buckets = db.posts.aggregate([
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$unwind": "$hashtags"},
+        {"$group": {
+            "_id": {
+                "tag": "$hashtags",
+                "bucket": {"$dateTrunc": {"date": "$created_at", "unit": "hour"}},
+            },
+            "count": {"$sum": 1},
+        }},
+    ])
+    bucket_operations = [
+        UpdateOne(
+            {"tag": row["_id"]["tag"], "bucket": row["_id"]["bucket"]},
+            {"$set": {"count": row["count"]}},
+            upsert=True,
+        )
+        async for row in buckets
+    ]
+    if bucket_operations:
+        await db.hashtag_buckets.bulk_write(bucket_operations, ordered=False)
+    logger.info("Rebuilt hashtag stats for %s hashtags.", len(operations))
+    return len(operations)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.hashtags rebuild")
+    asyncio.run(rebuild_hashtag_stats())
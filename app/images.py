@@ -0,0 +1,108 @@
+# app/images.py
+
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+
+from app.database import get_database
+from app.page_cache import invalidate_post
+from app.uploads import IMAGES_DIR, IMAGES_URL
+
+logger = logging.getLogger("app.images")
+
+# Resized variants generated for every upload: name -> maximum width in pixels.
+VARIANT_WIDTHS = {"feed": 320, "feed_2x": 640, "detail": 1080}
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_WEBP = os.getenv("IMAGE_WEBP", "1") == "1"
+JPEG_QUALITY = 82
+
+_pool = None
+
+
+def _generate_variants(filename: str, webp: bool) -> dict:
+    """
+    Runs in a worker process: writes resized copies of an uploaded image next
+    to the original and returns their URLs keyed by variant name.
+    """
+    from PIL import Image, ImageOps
+
+    stem = os.path.splitext(filename)[0]
+    variants = {}
+    with Image.open(os.path.join(IMAGES_DIR, filename)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        for name, width in VARIANT_WIDTHS.items():
+            formats = [("jpg", "JPEG")] + ([("webp", "WEBP")] if webp else [])
+            resized = None
+            for extension, image_format in formats:
+                variant_name = f"{stem}_{name}.{extension}"
+                variant_path = os.path.join(IMAGES_DIR, variant_name)
+                # Content-addressed names mean an existing variant is already correct.
+                if not os.path.exists(variant_path):
+                    if resized is None:
+                        resized = image.copy()
+                        resized.thumbnail((width, width * 4))
+                    temp_path = f"{variant_path}.part"
+                    resized.save(temp_path, image_format, quality=JPEG_QUALITY, optimize=True)
+                    os.replace(temp_path, variant_path)
+                key = name if extension == "jpg" else f"{name}_webp"
+                variants[key] = f"{IMAGES_URL}/{variant_name}"
+    return variants
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def generate_post_variants(db, post_id, image_url: str) -> dict:
+    """
+    Generates the resized variants of a post's image in the process pool and
+    records their URLs on the post as `image_variants`.
+    """
+    if find_spec("PIL") is None:
+        logger.warning("Pillow is not installed; skipping image variants.")
+        return {}
+    filename = os.path.basename(image_url)
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(_get_pool(), _generate_variants, filename, IMAGE_WEBP)
+    await db.posts.update_one({"_id": post_id}, {"$set": {"image_variants": variants}})
+    invalidate_post(post_id)
+    return variants
+
+
+async def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        # Waiting for running resizes blocks, so it happens off the event loop.
+        await asyncio.to_thread(pool.shutdown, True)
+
+
+async def backfill_post_variants(db=None) -> int:
+    """
+    Generates variants for posts created before variant generation existed.
+    """
+    db = db if db is not None else get_database()
+    generated = 0
+    async for post in db.posts.find({"image_variants": {"$exists": False}}, {"image_url": 1}):
+        try:
+            await generate_post_variants(db, post["_id"], post["image_url"])
+            generated += 1
+        except Exception as e:
+            logger.error("Error generating image variants for post %s: %s", post['_id'], e)
+    await shutdown_image_pool()
+    logger.info("Generated image variants for %s posts.", generated)
+    return generated
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_post_variants())
@@ -0,0 +1,85 @@
+# app/interactions.py
+
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from app.auth import invalidate_cached_user
+from app.counters import increment_post_counter
+from app.follows import follow, unfollow, follow_many, unfollow_many
+from app.like_buffer import like_buffer
+from app.likes import toggle_like_now, remember_like
+from app.page_cache import invalidate_post, invalidate_profile
+from app.timeline import backfill_timeline, remove_author_from_timeline, remove_authors_from_timeline
+
+# Write paths shared by the HTML routes in app/main.py and the JSON API in app/api.py.
+
+
+async def toggle_like(db, post: dict, user_id: ObjectId) -> bool:
+    """
+    Likes the post, or removes the like if it already exists. Returns True
+    if the post is liked afterwards.
+    """
+    if like_buffer.running:
+        # Write-behind: acknowledged once journaled, written on the next flush.
+        liked = await like_buffer.toggle(db, post["_id"], user_id)
+    else:
+        liked = await toggle_like_now(db, post["_id"], user_id)
+        invalidate_post(post["_id"])
+    remember_like(user_id, post["_id"], liked)
+    return liked
+
+
+async def add_comment(db, post: dict, user_id: ObjectId, text: str) -> dict:
+    comment_data = {
+        "text": text,
+        "user_id": user_id,
+        "post_id": post["_id"],
+        "created_at": datetime.utcnow(),
+    }
+    result = await db.comments.insert_one(comment_data)
+    await increment_post_counter(db, post["_id"], "comments_count", 1)
+    invalidate_post(post["_id"])
+    comment_data["_id"] = result.inserted_id
+    return comment_data
+
+
+async def toggle_follow(db, follower_id: ObjectId, target_user: dict) -> bool:
+    """
+    Follows `target_user`, or unfollows if already following, keeping the
+    follower's timeline and the cached users and profiles in step. Returns
+    True if following afterwards.
+    """
+    target_id = target_user["_id"]
+    if await unfollow(db, follower_id, target_id):
+        await remove_author_from_timeline(db, follower_id, target_id)
+        following = False
+    else:
+        # follow() is False only when a concurrent request created the edge first.
+        if await follow(db, follower_id, target_id):
+            await backfill_timeline(db, follower_id, target_user)
+        following = True
+    for user_id in (follower_id, target_id):
+        invalidate_cached_user(user_id)
+        invalidate_profile(user_id)
+    return following
+
+
+async def bulk_follow(db, follower_id: ObjectId, follow_users: list, unfollow_ids: list) -> tuple:
+    """
+    Follows every user in `follow_users` and unfollows every id in
+    `unfollow_ids` with one write per side. Returns the (followed, unfollowed)
+    ids that actually changed.
+    """
+    followed = await follow_many(db, follower_id, [user["_id"] for user in follow_users])
+    unfollowed = await unfollow_many(db, follower_id, unfollow_ids)
+    users_by_id = {user["_id"]: user for user in follow_users}
+    await asyncio.gather(*(backfill_timeline(db, follower_id, users_by_id[user_id]) for user_id in followed))
+    if unfollowed:
+        await remove_authors_from_timeline(db, follower_id, unfollowed)
+    if followed or unfollowed:
+        for user_id in [follower_id, *followed, *unfollowed]:
+            invalidate_cached_user(user_id)
+            invalidate_profile(user_id)
+    return followed, unfollowed
@@ -0,0 +1,394 @@
+# app/jobs.py
+
+import os
+import sys
+import time
+import random
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+from app.database import close_db, connect_db, get_database, init_db
+from app.hashtags import record_hashtags
+from app.images import generate_post_variants, shutdown_image_pool
+from app.timeline import fan_out_post
+
+logger = logging.getLogger("app.jobs")
+
+# Worker coroutines per process.
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+# Set to 0 when jobs are run by separate `python -m app.jobs` processes.
+JOB_WORKERS_IN_APP = os.getenv("JOB_WORKERS_IN_APP", "1") == "1"
+# Seconds a claimed job stays hidden from other workers. A worker that dies
+# mid-job leaves it to be picked up again once this runs out.
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))
+# Runs before a job is marked failed; retries back off exponentially from
+# JOB_RETRY_DELAY seconds up to JOB_RETRY_MAX_DELAY.
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "2"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "600"))
+# How often idle workers look for new jobs and outbox entries, in seconds.
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# How long finished jobs are kept before MongoDB expires them, in seconds.
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+RELAY_BATCH_SIZE = 100
+# Longest error message kept on a job.
+ERROR_CHARS = 1000
+
+
+async def _fan_out(db, payload: dict):
+    post = await db.posts.find_one({"_id": payload["post_id"]}, {"user_id": 1, "created_at": 1})
+    if post is None:
+        return
+    author = await db.users.find_one({"_id": post["user_id"]}, {"followers_count": 1, "fanout_mode": 1})
+    if author is not None:
+        await fan_out_post(db, post, author)
+
+
+async def _count_hashtags(db, payload: dict):
+    # The counters are incremented, not set, so the post is marked first: a
+    # retry never counts twice, and a crash in between is fixed by
+    # `python -m app.hashtags rebuild`.
+    post = await db.posts.find_one_and_update(
+        {"_id": payload["post_id"], "hashtags_counted": {"$ne": True}},
+        {"$set": {"hashtags_counted": True}},
+        projection={"hashtags": 1, "created_at": 1},
+    )
+    if post is not None:
+        await record_hashtags(db, post.get("hashtags", []), post["created_at"])
+
+
+async def _image_variants(db, payload: dict):
+    post = await db.posts.find_one({"_id": payload["post_id"]}, {"image_url": 1})
+    if post is not None:
+        await generate_post_variants(db, post["_id"], post["image_url"])
+
+
+# Job name -> handler(db, payload). Handlers must be safe to run more than
+# once for the same payload: a job is retried after errors and timeouts.
+HANDLERS = {
+    "fan_out_post": _fan_out,
+    "record_hashtags": _count_hashtags,
+    "image_variants": _image_variants,
+}
+
+
+def outbox_entry(name: str, payload: dict, key: str) -> dict:
+    """
+    A job to store in a document's `outbox` array. It is written by the same
+    insert or update as the document, so the two are saved atomically; the
+    relay then copies it into the jobs collection under `key`, which is the
+    job's _id, so the job is created exactly once.
+    """
+    if name not in HANDLERS:
+        raise ValueError(f"Unknown job: {name}")
+    return {"key": key, "name": name, "payload": payload}
+
+
+def post_created_jobs(post_id: ObjectId) -> list:
+    """
+    The outbox of a new post: timeline fan-out, hashtag statistics and image variants.
+    """
+    return [
+        outbox_entry(name, {"post_id": post_id}, f"{name}:{post_id}")
+        for name in ("fan_out_post", "record_hashtags", "image_variants")
+    ]
+
+
+async def relay_outbox(db, limit: int = RELAY_BATCH_SIZE) -> int:
+    """
+    Moves outbox entries of posts into the jobs collection. Safe to run
+    concurrently from every worker.
+    """
+    posts = await db.posts.find({"outbox.key": {"$exists": True}}, {"outbox": 1}).to_list(length=limit)
+    if not posts:
+        return 0
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"_id": entry["key"]},
+            {"$setOnInsert": {
+                "name": entry["name"],
+                "payload": entry["payload"],
+                "status": "queued",
+                "attempts": 0,
+                "run_at": now,
+                "created_at": now,
+            }},
+            upsert=True,
+        )
+        for post in posts
+        for entry in post["outbox"]
+    ]
+    result = await db.jobs.bulk_write(operations, ordered=False)
+    # Only the relayed entries are pulled, in case more were added meanwhile.
+    cleanup = []
+    for post in posts:
+        keys = [entry["key"] for entry in post["outbox"]]
+        cleanup.append(UpdateOne({"_id": post["_id"]}, {"$pull": {"outbox": {"key": {"$in": keys}}}}))
+        cleanup.append(UpdateOne({"_id": post["_id"], "outbox": []}, {"$unset": {"outbox": ""}}))
+    await db.posts.bulk_write(cleanup)
+    return result.upserted_count
+
+
+async def claim_job(db) -> Optional[dict]:
+    """
+    Takes the next due job and hides it from other workers for
+    JOB_VISIBILITY_TIMEOUT seconds. The returned job carries a new `lease`,
+    which only its current holder can finish it with.
+    """
+    now = datetime.utcnow()
+    return await db.jobs.find_one_and_update(
+        {"status": "queued", "run_at": {"$lte": now}},
+        {
+            "$set": {"run_at": now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT), "lease": ObjectId()},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_DELAY * 2 ** (attempts - 1))
+    # Jitter, so jobs that failed together don't retry together.
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def run_job(db, job: dict) -> bool:
+    """
+    Runs a claimed job and records the outcome. Returns whether it succeeded.
+    """
+    now = datetime.utcnow()
+    owned = {"_id": job["_id"], "lease": job["lease"]}
+    error = None
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        # Its last attempt timed out.
+        error = "Visibility timeout expired on the last attempt."
+    else:
+        try:
+            await HANDLERS[job["name"]](db, job["payload"])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    finished = {"finished_at": datetime.utcnow(), "expires_at": now + timedelta(seconds=JOB_RETENTION_SECONDS)}
+    if error is None:
+        await db.jobs.update_one(owned, {"$set": {"status": "done", **finished}, "$unset": {"lease": ""}})
+        return True
+    if job["attempts"] >= JOB_MAX_ATTEMPTS:
+        # Failed jobs are kept until requeued (`python -m app.jobs requeue`).
+        await db.jobs.update_one(
+            owned,
+            {"$set": {"status": "failed", "finished_at": finished["finished_at"], "error": error[:ERROR_CHARS]}},
+        )
+        logger.error("Job %s failed after %s attempts: %s", job["_id"], job["attempts"], error)
+    else:
+        delay = retry_delay(job["attempts"])
+        await db.jobs.update_one(
+            owned, {"$set": {"run_at": now + timedelta(seconds=delay), "error": error[:ERROR_CHARS]}}
+        )
+        logger.warning("Job %s failed (attempt %s), retrying in %.1fs: %s", job["_id"], job["attempts"], delay, error)
+    return False
+
+
+class JobRunner:
+    """
+    Relays outboxes and runs jobs with JOB_CONCURRENCY worker coroutines.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.running = False
+        self.succeeded = 0
+        self.failed = 0
+        self.relayed = 0
+        self.last_run_seconds = 0.0
+        self._tasks = []
+        self._wake = None
+        self._work = None
+
+    def notify(self):
+        """
+        Wakes the relay and workers after an outbox write, instead of them
+        waiting for the next poll.
+        """
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _sleep(self):
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _relay(self):
+        while True:
+            await self._sleep()
+            self._wake.clear()
+            try:
+                relayed = await relay_outbox(get_database())
+            except Exception as e:
+                logger.error("Error relaying job outboxes: %s", e)
+                continue
+            if relayed:
+                self.relayed += relayed
+                self._work.set()
+
+    async def _worker(self):
+        while True:
+            db = get_database()
+            try:
+                job = await claim_job(db)
+            except Exception as e:
+                logger.error("Error claiming job: %s", e)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._work.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._work.clear()
+                continue
+            started = time.perf_counter()
+            try:
+                if await run_job(db, job):
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+            except Exception as e:
+                # Recording the outcome failed; the job reappears after its timeout.
+                logger.error("Error finishing job %s: %s", job["_id"], e)
+            self.last_run_seconds = time.perf_counter() - started
+
+    def start(self):
+        if not self._tasks:
+            self._wake = asyncio.Event()
+            self._work = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._relay())]
+            self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+            self.running = True
+
+    async def stop(self):
+        """
+        Stops the workers. A job that was cut off reappears after its
+        visibility timeout.
+        """
+        if not self._tasks:
+            return
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wake = None
+        self._work = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "relayed": self.relayed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+
+job_runner = JobRunner(JOB_CONCURRENCY)
+
+
+def start_job_workers():
+    if JOB_WORKERS_IN_APP:
+        job_runner.start()
+
+
+async def stop_job_workers():
+    await job_runner.stop()
+
+
+async def queue_stats(db=None) -> dict:
+    """
+    Job counts by state, for /stats/jobs.
+    """
+    db = db if db is not None else get_database()
+    now = datetime.utcnow()
+    pending = db.jobs.count_documents({"status": "queued", "run_at": {"$lte": now}})
+    delayed = db.jobs.count_documents({"status": "queued", "run_at": {"$gt": now}})
+    failed = db.jobs.count_documents({"status": "failed"})
+    outbox = db.posts.count_documents({"outbox.key": {"$exists": True}})
+    counts = await asyncio.gather(pending, delayed, failed, outbox)
+    return dict(zip(("due", "delayed_or_running", "failed", "posts_with_outbox"), counts))
+
+
+async def requeue_failed(db=None) -> int:
+    """
+    Gives failed jobs a fresh set of attempts.
+    """
+    db = db if db is not None else get_database()
+    result = await db.jobs.update_many(
+        {"status": "failed"},
+        {
+            "$set": {"status": "queued", "attempts": 0, "run_at": datetime.utcnow()},
+            "$unset": {"finished_at": "", "lease": ""},
+        },
+    )
+    logger.info("Requeued %s failed jobs.", result.modified_count)
+    return result.modified_count
+
+
+async def _serve(concurrency: int):
+    await asyncio.gather(connect_db(), init_db())
+    runner = JobRunner(concurrency)
+    runner.start()
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    logger.info("Job worker %s started with %s workers.", os.getpid(), concurrency)
+    await stopped.wait()
+    await runner.stop()
+    await shutdown_image_pool()
+    await close_db()
+    logger.info("Job worker %s stopped: %s", os.getpid(), runner.stats())
+
+
+def _serve_process(concurrency: int):
+    asyncio.run(_serve(concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs outside the web workers.")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "stats", "requeue"])
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes")
+    parser.add_argument("--concurrency", type=int, default=JOB_CONCURRENCY, help="Worker coroutines per process")
+    args = parser.parse_args()
+    if args.command == "stats":
+        print(asyncio.run(queue_stats()))
+    elif args.command == "requeue":
+        asyncio.run(requeue_failed())
+    elif args.processes <= 1:
+        _serve_process(args.concurrency)
+    else:
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=_serve_process, args=(args.concurrency,)) for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        # Ctrl-C reaches the whole process group; SIGTERM is passed on.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+        for process in processes:
+            process.join()
+        sys.exit(max(process.exitcode or 0 for process in processes))
+
+
+if __name__ == "__main__":
+    main()
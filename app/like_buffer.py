@@ -0,0 +1,463 @@
+# app/like_buffer.py
+
+import os
+import glob
+import time
+import random
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+
+from app.counters import increment_post_counter
+from app.database import get_database
+from app.page_cache import invalidate_post
+
+logger = logging.getLogger("app.like_buffer")
+
+# Set to 0 to write every like straight to MongoDB.
+LIKE_WRITE_BEHIND = os.getenv("LIKE_WRITE_BEHIND", "1") == "1"
+# How often buffered likes are flushed, in seconds.
+LIKE_FLUSH_INTERVAL = float(os.getenv("LIKE_FLUSH_INTERVAL", "1.0"))
+# Number of buffered (post, user) pairs that triggers an early flush.
+LIKE_FLUSH_MAX = int(os.getenv("LIKE_FLUSH_MAX", "10000"))
+# Where each worker journals acknowledged likes until they are flushed.
+LIKE_JOURNAL_DIR = os.getenv(
+    "LIKE_JOURNAL_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'like_journal')
+)
+# Posts with at least this many like events in one flush count as hot; their
+# counter updates are spread over LIKE_COUNTER_SHARDS shard documents.
+LIKE_HOT_THRESHOLD = int(os.getenv("LIKE_HOT_THRESHOLD", "100"))
+LIKE_COUNTER_SHARDS = int(os.getenv("LIKE_COUNTER_SHARDS", "16"))
+# How often shard documents are folded back into posts.likes_count, in seconds.
+LIKE_SHARD_FOLD_SECONDS = float(os.getenv("LIKE_SHARD_FOLD_SECONDS", "10"))
+
+SEGMENT_PATTERN = "likes-*-*.jsonl"
+# Appended to a segment by the worker replaying it, followed by its pid.
+REPLAYING_SUFFIX = ".replaying-"
+
+
+def _write_lines(path: str, lines: list):
+    with open(path, "a", encoding="utf-8") as file:
+        file.writelines(lines)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LikeJournal:
+    """
+    Append-only, fsynced log of this worker's like events. Appends that
+    arrive while a write is in progress are committed together with one
+    fsync. The log is split into segments; a segment is deleted once every
+    event in it has been flushed to MongoDB.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.pid = os.getpid()
+        self.sequence = 0
+        self.path = None
+        self._queue = []
+        self._drain_task = None
+        self._write_task = None
+
+    def _segment_path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f"likes-{self.pid}-{sequence:08d}.jsonl")
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.pid = os.getpid()
+        self.path = self._segment_path(self.sequence)
+
+    def rotate(self) -> tuple:
+        """
+        Starts a new segment. Returns the previous segment and the write that
+        may still be appending to it.
+        """
+        previous = self.path
+        self.sequence += 1
+        self.path = self._segment_path(self.sequence)
+        return previous, self._write_task
+
+    async def append(self, record: dict):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((json_util.dumps(record) + "\n", future))
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.create_task(self._drain())
+        await future
+
+    async def _drain(self):
+        while self._queue:
+            batch, self._queue = self._queue, []
+            self._write_task = asyncio.ensure_future(
+                run_in_threadpool(_write_lines, self.path, [line for line, _ in batch])
+            )
+            try:
+                await self._write_task
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    @staticmethod
+    async def retire(path: str, write_task=None):
+        if write_task is not None:
+            try:
+                await write_task
+            except Exception:
+                pass
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+async def _apply_likes(db, events: dict) -> tuple:
+    """
+    Writes the final state of each (post, user) pair. Returns the exact
+    per-post change in likes and the number of events per post.
+    """
+    deltas = Counter()
+    activity = Counter()
+    upserts, upsert_posts = [], []
+    deletes = {}
+    for (post_id, user_id), (liked, at) in events.items():
+        activity[post_id] += 1
+        if liked:
+            upserts.append(UpdateOne(
+                {"post_id": post_id, "user_id": user_id},
+                {"$setOnInsert": {"created_at": at}},
+                upsert=True,
+            ))
+            upsert_posts.append(post_id)
+        else:
+            deletes.setdefault(post_id, []).append(user_id)
+    if upserts:
+        try:
+            upserted = (await db.likes.bulk_write(upserts, ordered=False)).upserted_ids
+        except BulkWriteError as e:
+            # A concurrent writer inserting the same like is harmless; anything else is not.
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            upserted = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+        for index in upserted:
+            deltas[upsert_posts[index]] += 1
+    for post_id, user_ids in deletes.items():
+        result = await db.likes.delete_many({"post_id": post_id, "user_id": {"$in": user_ids}})
+        deltas[post_id] -= result.deleted_count
+    return deltas, activity
+
+
+async def _write_counts(collection, operations: list, post_ids: list, deltas: Counter):
+    """
+    Runs unordered counter updates and removes the posts whose update was
+    applied from `deltas`, so a retry only repeats the ones that failed.
+    """
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"] for error in e.details.get("writeErrors", [])}
+        for index, post_id in enumerate(post_ids):
+            if index not in failed:
+                del deltas[post_id]
+        raise
+    for post_id in post_ids:
+        del deltas[post_id]
+
+
+async def _apply_counts(db, deltas: Counter, activity: Counter):
+    """
+    Applies per-post like deltas to posts.likes_count, or to a counter shard
+    for hot posts. Applied and zero deltas are removed from `deltas`.
+    """
+    post_operations, post_ids = [], []
+    shard_operations, shard_post_ids = [], []
+    for post_id, delta in list(deltas.items()):
+        if not delta:
+            del deltas[post_id]
+        elif activity[post_id] >= LIKE_HOT_THRESHOLD:
+            shard = random.randrange(LIKE_COUNTER_SHARDS)
+            shard_operations.append(UpdateOne(
+                {"post_id": post_id, "shard": shard}, {"$inc": {"likes_count": delta}}, upsert=True
+            ))
+            shard_post_ids.append(post_id)
+        else:
+            post_operations.append(UpdateOne({"_id": post_id}, {"$inc": {"likes_count": delta}}))
+            post_ids.append(post_id)
+    if post_operations:
+        await _write_counts(db.posts, post_operations, post_ids, deltas)
+    if shard_operations:
+        await _write_counts(db.like_counter_shards, shard_operations, shard_post_ids, deltas)
+
+
+class LikeBuffer:
+    """
+    Per-worker write-behind buffer for likes. Toggles only touch memory and
+    the journal; repeated toggles of the same (post, user) pair collapse to
+    their final state, which is written with bulk_write on the next flush.
+    """
+
+    def __init__(self, journal: LikeJournal):
+        self.journal = journal
+        self.pending = {}
+        self.flushing = {}
+        # Like changes already written to db.likes whose counter updates
+        # have not been applied yet.
+        self.unapplied_deltas = Counter()
+        self.unapplied_activity = Counter()
+        self.running = False
+        self._unflushed_segments = []
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task = None
+        self.events = 0
+        self.flushes = 0
+        self.flushed_pairs = 0
+        self.last_flush_seconds = 0.0
+
+    async def _current_state(self, db, key: tuple) -> bool:
+        for events in (self.pending, self.flushing):
+            if key in events:
+                return events[key][0]
+        post_id, user_id = key
+        # MongoDB, not the liked cache: another worker may have toggled the
+        # pair since this worker cached it.
+        liked = await db.likes.find_one({"post_id": post_id, "user_id": user_id}, {"_id": 1}) is not None
+        # The pair may have been toggled by another request while we waited.
+        for events in (self.pending, self.flushing):
+            if key in events:
+                return events[key][0]
+        return liked
+
+    async def toggle(self, db, post_id, user_id) -> bool:
+        """
+        Flips the like state of (post, user) and returns the new state once
+        the event is durable in the journal.
+        """
+        key = (post_id, user_id)
+        liked = not await self._current_state(db, key)
+        at = datetime.utcnow()
+        self.pending[key] = (liked, at)
+        self.events += 1
+        if len(self.pending) >= LIKE_FLUSH_MAX:
+            self._wake.set()
+        await self.journal.append({"post_id": post_id, "user_id": user_id, "liked": liked, "at": at})
+        return liked
+
+    async def flush(self, db) -> int:
+        async with self._flush_lock:
+            if not self.pending and not self.unapplied_deltas:
+                return 0
+            started = time.perf_counter()
+            flushed = {}
+            if self.pending:
+                # Swap the buffer and the journal segment together, so every event
+                # in the retired segment is part of this flush.
+                self.flushing, self.pending = self.pending, {}
+                segment, write_task = self.journal.rotate()
+                self._unflushed_segments.append((segment, write_task))
+                try:
+                    deltas, activity = await _apply_likes(db, self.flushing)
+                except BaseException:
+                    # Keep the events (newer toggles win) and the segments for the next attempt.
+                    self.pending = {**self.flushing, **self.pending}
+                    raise
+                finally:
+                    flushed = self.flushing
+                    self.flushing = {}
+                self.unapplied_deltas.update(deltas)
+                self.unapplied_activity.update(activity)
+            # The likes are stored now, so re-running them would compute no
+            # change; a failed counter update is retried from the kept deltas.
+            # The segments stay on disk until then, for a replay to recount.
+            post_ids = list(self.unapplied_deltas)
+            await _apply_counts(db, self.unapplied_deltas, self.unapplied_activity)
+            self.unapplied_activity = Counter()
+            for post_id in post_ids:
+                invalidate_post(post_id)
+            segments, self._unflushed_segments = self._unflushed_segments, []
+            for path, task in segments:
+                await self.journal.retire(path, task)
+            self.flushes += 1
+            self.flushed_pairs += len(flushed)
+            self.last_flush_seconds = time.perf_counter() - started
+            return len(flushed)
+
+    async def _run(self):
+        last_fold = time.monotonic()
+        while self.running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=LIKE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self.running:
+                break
+            db = get_database()
+            try:
+                await self.flush(db)
+            except Exception as e:
+                logger.error("Error flushing buffered likes: %s", e)
+            if time.monotonic() - last_fold >= LIKE_SHARD_FOLD_SECONDS:
+                last_fold = time.monotonic()
+                try:
+                    await fold_counter_shards(db)
+                except Exception as e:
+                    logger.error("Error folding like counter shards: %s", e)
+
+    def start(self):
+        if self._task is None:
+            self.journal.open()
+            self._flush_lock = asyncio.Lock()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            self.running = True
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Let a flush in progress finish rather than cancelling it halfway.
+        self.running = False
+        self._wake.set()
+        await self._task
+        self._task = None
+        db = get_database()
+        try:
+            await self.flush(db)
+            await fold_counter_shards(db)
+        except Exception as e:
+            # The unflushed segments stay on disk and are replayed on the next start.
+            logger.error("Error flushing buffered likes on shutdown: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "unapplied_counts": len(self.unapplied_deltas),
+            "events": self.events,
+            "flushes": self.flushes,
+            "flushed_pairs": self.flushed_pairs,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+like_buffer = LikeBuffer(LikeJournal(LIKE_JOURNAL_DIR))
+
+
+async def fold_counter_shards(db=None) -> int:
+    """
+    Moves the counts accumulated in like_counter_shards onto posts.likes_count.
+    Each shard is swapped to zero atomically, so concurrent folds are safe.
+    """
+    db = db if db is not None else get_database()
+    folded = Counter()
+    async for shard in db.like_counter_shards.find({"likes_count": {"$ne": 0}}, {"_id": 1}):
+        previous = await db.like_counter_shards.find_one_and_update(
+            {"_id": shard["_id"]},
+            {"$set": {"likes_count": 0}},
+            projection={"post_id": 1, "likes_count": 1},
+        )
+        if previous and previous.get("likes_count"):
+            folded[previous["post_id"]] += previous["likes_count"]
+    for post_id, amount in folded.items():
+        await increment_post_counter(db, post_id, "likes_count", amount)
+        invalidate_post(post_id)
+    return len(folded)
+
+
+def _owner_pid(path: str) -> int:
+    name = os.path.basename(path)
+    if REPLAYING_SUFFIX in name:
+        return int(name.rsplit("-", 1)[1])
+    return int(name.split("-")[1])
+
+
+def _claim_segments() -> list:
+    """
+    Renames the segments of dead workers, and those a dead worker was
+    replaying, to this worker's replaying name. A rename is atomic, so when
+    several workers start together each segment is claimed by exactly one.
+    """
+    pattern = os.path.join(LIKE_JOURNAL_DIR, SEGMENT_PATTERN)
+    claimed = []
+    for path in glob.glob(pattern) + glob.glob(pattern + REPLAYING_SUFFIX + "*"):
+        pid = _owner_pid(path)
+        if pid != os.getpid() and _pid_alive(pid):
+            continue
+        target = path.split(REPLAYING_SUFFIX)[0] + REPLAYING_SUFFIX + str(os.getpid())
+        try:
+            os.rename(path, target)
+        except FileNotFoundError:
+            # Claimed by another worker first.
+            continue
+        claimed.append(target)
+    return claimed
+
+
+async def replay_like_journal(db=None) -> int:
+    """
+    Applies journal segments left behind by workers that exited without
+    flushing, then recounts likes for the posts they touched.
+    """
+    db = db if db is not None else get_database()
+    segments = _claim_segments()
+    if not segments:
+        return 0
+    events = {}
+    for path in sorted(segments):
+        try:
+            with open(path, encoding="utf-8") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            continue
+        for line in lines:
+            try:
+                record = json_util.loads(line)
+            except ValueError:
+                # A torn final line was never acknowledged.
+                continue
+            key = (record["post_id"], record["user_id"])
+            if key not in events or events[key][1] <= record["at"]:
+                events[key] = (record["liked"], record["at"])
+    await _apply_likes(db, events)
+    # The crash may have happened between writing likes and counters, so recount.
+    post_ids = {post_id for post_id, _ in events}
+    for post_id in post_ids:
+        likes_count = await db.likes.count_documents({"post_id": post_id})
+        await db.like_counter_shards.delete_many({"post_id": post_id})
+        await db.posts.update_one({"_id": post_id}, {"$set": {"likes_count": likes_count}})
+        invalidate_post(post_id)
+    for path in segments:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    logger.info("Replayed %s buffered likes from %s journal segments.", len(events), len(segments))
+    return len(events)
+
+
+async def start_like_buffer():
+    if not LIKE_WRITE_BEHIND:
+        return
+    await replay_like_journal()
+    like_buffer.start()
+
+
+async def stop_like_buffer():
+    await like_buffer.stop()
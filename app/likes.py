@@ -0,0 +1,123 @@
+# app/likes.py
+
+import os
+import sys
+import asyncio
+import logging
+from datetime import datetime
+from typing import Iterable
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from app.cache import TTLCache
+from app.counters import increment_post_counter
+from app.database import get_database
+
+logger = logging.getLogger("app.likes")
+
+# Per-user memory of which posts they have (or have not) liked, filled by
+# listing lookups and kept current by this worker's own toggles. Only used
+# to render Like/Unlike buttons; toggles read MongoDB.
+LIKED_CACHE_SIZE = int(os.getenv("LIKED_CACHE_SIZE", "10000"))
+LIKED_CACHE_TTL = float(os.getenv("LIKED_CACHE_TTL", "60"))
+# Most post ids remembered per user; the oldest are forgotten first.
+LIKED_CACHE_POSTS_PER_USER = 1000
+DEDUPE_BATCH_SIZE = 1000
+
+liked_cache = TTLCache(maxsize=LIKED_CACHE_SIZE, ttl=LIKED_CACHE_TTL)
+
+
+def remember_like(user_id, post_id, liked: bool):
+    states = liked_cache.get(user_id)
+    if states is None:
+        states = {}
+    states.pop(post_id, None)
+    states[post_id] = liked
+    while len(states) > LIKED_CACHE_POSTS_PER_USER:
+        states.pop(next(iter(states)))
+    liked_cache.set(user_id, states)
+
+
+async def liked_post_ids(db, user_id, post_ids: Iterable) -> set:
+    """
+    Returns which of `post_ids` the user has liked, using one `$in` query for
+    the posts not already in their recent-likes cache.
+    """
+    post_ids = list(dict.fromkeys(post_ids))
+    states = liked_cache.get(user_id)
+    if states is None:
+        states = {}
+    unknown = [post_id for post_id in post_ids if post_id not in states]
+    if unknown:
+        cursor = db.likes.find({"user_id": user_id, "post_id": {"$in": unknown}}, {"post_id": 1, "_id": 0})
+        liked = {like["post_id"] async for like in cursor}
+        for post_id in unknown:
+            states[post_id] = post_id in liked
+        while len(states) > LIKED_CACHE_POSTS_PER_USER:
+            states.pop(next(iter(states)))
+        liked_cache.set(user_id, states)
+    return {post_id for post_id in post_ids if states.get(post_id)}
+
+
+async def toggle_like_now(db, post_id, user_id) -> bool:
+    """
+    Toggles a like directly in MongoDB. Relies on the unique
+    (post_id, user_id) index: an unlike is a single delete, a like a single
+    upsert, and concurrent clicks cannot create duplicates.
+    """
+    result = await db.likes.delete_one({"post_id": post_id, "user_id": user_id})
+    if result.deleted_count:
+        await increment_post_counter(db, post_id, "likes_count", -1)
+        return False
+    try:
+        result = await db.likes.update_one(
+            {"post_id": post_id, "user_id": user_id},
+            {"$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # A concurrent request inserted the same like first.
+        return True
+    if result.upserted_id is not None:
+        await increment_post_counter(db, post_id, "likes_count", 1)
+    return True
+
+
+async def dedupe_likes(db=None) -> int:
+    """
+    Removes duplicate (post_id, user_id) likes, keeping the oldest, fixes the
+    affected posts' likes_count and creates the unique like index.
+    """
+    db = db if db is not None else get_database()
+    pipeline = [
+        {"$group": {
+            "_id": {"post_id": "$post_id", "user_id": "$user_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    removed = 0
+    duplicate_ids = []
+    post_ids = set()
+    async for row in db.likes.aggregate(pipeline, allowDiskUse=True):
+        duplicate_ids.extend(sorted(row["ids"])[1:])
+        post_ids.add(row["_id"]["post_id"])
+        if len(duplicate_ids) >= DEDUPE_BATCH_SIZE:
+            removed += (await db.likes.delete_many({"_id": {"$in": duplicate_ids}})).deleted_count
+            duplicate_ids = []
+    if duplicate_ids:
+        removed += (await db.likes.delete_many({"_id": {"$in": duplicate_ids}})).deleted_count
+    for post_id in post_ids:
+        likes_count = await db.likes.count_documents({"post_id": post_id})
+        await db.posts.update_one({"_id": post_id}, {"$set": {"likes_count": likes_count}})
+    await db.likes.create_index([("post_id", ASCENDING), ("user_id", ASCENDING)], unique=True)
+    logger.info("Removed %s duplicate likes from %s posts.", removed, len(post_ids))
+    return removed
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["dedupe"]:
+        sys.exit("usage: python -m app.likes dedupe")
+    asyncio.run(dedupe_likes())
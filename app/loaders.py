@@ -0,0 +1,83 @@
+# app/loaders.py
+
+import asyncio
+from typing import Dict, Iterable, Optional
+
+from starlette.requests import Request
+
+from app.database import get_database
+
+
+class UserLoader:
+    """
+    Request-scoped batch loader for user documents.
+
+    Every call to load() made before the event loop gets a chance to run the
+    pending dispatch is collected into a single `$in` query. Results are
+    memoized for the lifetime of the loader, so repeat authors on the same
+    page are only fetched once.
+    """
+
+    def __init__(self, db, projection: Optional[dict] = None):
+        self._db = db
+        self._projection = projection or {"username": 1}
+        self._futures: Dict = {}
+        self._pending = []
+        self._dispatch_scheduled = False
+
+    def load(self, user_id) -> asyncio.Future:
+        future = self._futures.get(user_id)
+        if future is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[user_id] = future
+        self._pending.append(user_id)
+        if not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+        return future
+
+    async def load_many(self, user_ids: Iterable) -> dict:
+        """
+        Returns a dict mapping each requested id to its user document
+        (or None when the user does not exist).
+        """
+        ids = list(dict.fromkeys(user_ids))
+        users = await asyncio.gather(*(self.load(user_id) for user_id in ids))
+        return dict(zip(ids, users))
+
+    async def _dispatch(self):
+        batch, self._pending = self._pending, []
+        self._dispatch_scheduled = False
+        try:
+            cursor = self._db.users.find({"_id": {"$in": batch}}, self._projection)
+            found = {user["_id"]: user async for user in cursor}
+        except Exception as exc:
+            for user_id in batch:
+                self._futures.pop(user_id).set_exception(exc)
+            return
+        for user_id in batch:
+            self._futures[user_id].set_result(found.get(user_id))
+
+
+def get_user_loader(request: Request) -> UserLoader:
+    """
+    Returns the UserLoader attached to the request, creating it on first use.
+    """
+    loader = getattr(request.state, "user_loader", None)
+    if loader is None:
+        loader = UserLoader(get_database())
+        request.state.user_loader = loader
+    return loader
+
+
+async def attach_usernames(loader: UserLoader, documents: list, key: str = "user_id") -> list:
+    """
+    Sets `username` on every document from the user referenced by `key`.
+    """
+    users = await loader.load_many(document[key] for document in documents)
+    for document in documents:
+        user = users.get(document[key])
+        document["username"] = user["username"] if user else "Unknown"
+    return documents
@@ -0,0 +1,127 @@
+# app/logs.py
+
+import os
+import sys
+import queue
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+# "json" writes one JSON object per line; "text" the classic
+# "time - logger - level - message" lines.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Records waiting for the writer thread. When it is full, new records are
+# dropped and counted rather than making the request wait.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of info-level records kept per event, e.g. "like=0.01,comment=0.1".
+# Events are tagged with extra={"event": ...}; warnings and errors are always kept.
+LOG_SAMPLE_RATES = {
+    event.strip(): float(rate)
+    for event, _, rate in (
+        item.partition("=") for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if "=" in item
+    )
+}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Attributes every LogRecord has; anything else was passed in `extra`.
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_lock = threading.Lock()
+_stats = {"queued": 0, "dropped": 0, "sampled_out": 0}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, with any `extra` fields as keys. Runs on the
+    writer thread, so the message is only built there.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = LOG_SAMPLE_RATES.get(getattr(record, "event", None))
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        _stats["sampled_out"] += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread without formatting them and without
+    ever blocking: a full queue drops the record.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler formats here, on the caller's thread. Arguments
+        # are passed through as-is, so log values rather than objects that
+        # are mutated afterwards.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            _stats["queued"] += 1
+        except queue.Full:
+            _stats["dropped"] += 1
+
+
+def configure_logging():
+    """
+    Routes every "app.*" logger through one bounded queue to a writer thread.
+    Safe to call more than once.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+        records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        handler = DroppingQueueHandler(records)
+        handler.addFilter(SamplingFilter())
+        logger = logging.getLogger("app")
+        logger.setLevel(LOG_LEVEL)
+        logger.addHandler(handler)
+        logger.propagate = False
+        _listener = QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Writes out what is still queued and stops the writer thread.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def logging_stats() -> dict:
+    return {**_stats, "queue_size": LOG_QUEUE_SIZE}
@@ -1,10 +1,9 @@
 # app/main.py
 
-import os
-import bcrypt
 import logging
 from datetime import datetime
 from typing import List, Optional
+from urllib.parse import urlsplit
 
 from bson import ObjectId
 from fastapi import (
@@ -16,36 +15,65 @@ from fastapi import (
     Form,
     Query,
 )
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from starlette.requests import Request
 
 from app.models import User, Post, Comment, Like
-from app.auth import get_current_user, create_access_token
-from app.database import get_database
+from app.auth import get_current_user, create_access_token, user_cache
+from app.database import get_database, health, pool_stats
+from app.uploads import store_upload
+from app.hashtags import get_hashtag_index, hashtag_search_query, WINDOWS
+from app.hashing import hash_password, verify_password, hashing_stats
+from app.like_buffer import like_buffer
+from app.jobs import job_runner, post_created_jobs, queue_stats
+from app.logs import logging_stats
+from app.metrics import render_metrics, require_metrics_access, slow_samples
+from app.likes import liked_post_ids
+from app.loaders import get_user_loader, attach_usernames
+from app.pagination import paginate, cached_count, count_cache
+from app.user_search import search_usernames, username_search_fields
+from app.page_cache import (
+    page_cache,
+    fragment_cache,
+    page_key,
+    get_page,
+    store_page,
+    fill_like_slots,
+    like_slot_filler,
+    invalidate_new_post,
+)
+from app.follows import LEGACY_ARRAYS, is_following
+from app.interactions import toggle_like, add_comment, toggle_follow
+from app.templating import templates, stream_template
+from app.timeline import read_feed
 
 router = APIRouter()
-templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), '..', 'templates'))
 
-# Configure logger
 logger = logging.getLogger("app.main")
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode("utf-8"), salt)
-    return hashed.decode("utf-8")
+async def _with_like_state(html: str, post_ids: list, current_user: User) -> HTMLResponse:
+    """
+    Completes a shared page for the viewer: one batched liked-by-me lookup
+    for every post on it, served from the recent-likes cache when possible.
+    """
+    liked = await liked_post_ids(get_database(), ObjectId(current_user.id), post_ids)
+    return fill_like_slots(html, liked)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+async def _stream_page(
+    name: str, context: dict, posts: list, current_user: User, key: Optional[tuple] = None
+) -> StreamingResponse:
+    """
+    Streams a listing page, filling the viewer's like buttons on the way out.
+    With a `key`, the shared page is cached once it has been fully rendered.
+    """
+    post_ids = [post["_id"] for post in posts]
+    liked = await liked_post_ids(get_database(), ObjectId(current_user.id), post_ids)
+    on_complete = None
+    if key is not None:
+        on_complete = lambda html: store_page(key, html, post_ids)
+    return stream_template(name, context, transform=like_slot_filler(liked), on_complete=on_complete)
 
 
 @router.get("/", response_class=HTMLResponse)
@@ -66,23 +94,24 @@ async def register_user_form(
     password: str = Form(..., min_length=6),
 ):
     db = get_database()
-    existing_user = await db.users.find_one({"$or": [{"username": username}, {"email": email}]})
+    existing_user = await db.users.find_one({"$or": [{"username": username}, {"email": email}]}, {"_id": 1})
     if existing_user:
         error_message = "Username or email already exists."
-        logger.warning(f"Registration failed: {error_message} Username: {username}, Email: {email}")
+        logger.warning("Registration failed: %s Username: %s, Email: %s", error_message, username, email)
         return templates.TemplateResponse(
             "register.html", {"request": request, "error": error_message}
         )
-    hashed_password = hash_password(password)
+    hashed_password = await hash_password(password)
     user_data = {
         "username": username,
         "email": email,
         "password": hashed_password,
-        "following": [],
-        "followers": [],
+        **username_search_fields(username),
+        "following_count": 0,
+        "followers_count": 0,
     }
     result = await db.users.insert_one(user_data)
-    logger.info(f"New user registered: {username} (ID: {result.inserted_id})")
+    logger.info("New user registered: %s (ID: %s)", username, result.inserted_id, extra={"event": "register"})
     return RedirectResponse(url="/login", status_code=303)
 
 
@@ -98,16 +127,16 @@ async def login_user_form(
     password: str = Form(...),
 ):
     db = get_database()
-    user = await db.users.find_one({"username": username})
+    user = await db.users.find_one({"username": username}, {"username": 1, "password": 1})
     if not user:
         error_message = "Invalid username or password."
-        logger.warning(f"Login failed: {error_message} Username: {username}")
+        logger.warning("Login failed: %s Username: %s", error_message, username)
         return templates.TemplateResponse(
             "login.html", {"request": request, "error": error_message}
         )
-    if not verify_password(password, user["password"]):
+    if not await verify_password(password, user["password"]):
         error_message = "Invalid username or password."
-        logger.warning(f"Login failed: {error_message} Username: {username}")
+        logger.warning("Login failed: %s Username: %s", error_message, username)
         return templates.TemplateResponse(
             "login.html", {"request": request, "error": error_message}
         )
@@ -121,7 +150,7 @@ async def login_user_form(
         samesite="Lax",  # Adjust based on your needs
         secure=False,     # Set to True in production when using HTTPS
     )
-    logger.info(f"User logged in: {username} (ID: {user['_id']})")
+    logger.info("User logged in: %s (ID: %s)", username, user['_id'], extra={"event": "login"})
     return response
 
 
@@ -129,43 +158,56 @@ async def login_user_form(
 async def logout():
     response = RedirectResponse(url="/", status_code=303)
     response.delete_cookie("token")
-    logger.info("User logged out.")
+    logger.info("User logged out.", extra={"event": "logout"})
     return response
 
 
 @router.get("/profile/{user_id}", response_class=HTMLResponse)
-async def get_user_profile_page(request: Request, user_id: str, current_user: User = Depends(get_current_user)):
+async def get_user_profile_page(
+    request: Request,
+    user_id: str,
+    skip: int = Query(0, ge=0, description="Number of posts to skip"),
+    limit: int = Query(10, ge=1, le=100, description="Number of posts to retrieve"),
+    after: Optional[str] = Query(None, description="Cursor of the last post on the previous page"),
+    before: Optional[str] = Query(None, description="Cursor of the first post on the next page"),
+    current_user: User = Depends(get_current_user),
+):
+    # The follow button differs per viewer, so the viewer is part of the key
+    key = page_key(f"profile:{user_id}", str(current_user.id), skip, limit, after, before)
+    cached_page = get_page(key)
+    if cached_page is not None:
+        return await _with_like_state(*cached_page, current_user)
     db = get_database()
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": ObjectId(user_id)}, LEGACY_ARRAYS)
     if not user:
         error_message = "User not found."
-        logger.warning(f"Profile access failed: {error_message} User ID: {user_id}")
+        logger.warning("Profile access failed: %s User ID: %s", error_message, user_id)
         return templates.TemplateResponse("index.html", {"request": request, "error": error_message})
     # Fetch user's posts with pagination
-    skip = int(request.query_params.get("skip", 0))
-    limit = int(request.query_params.get("limit", 10))
     query = {"user_id": ObjectId(user_id)}
-    total_posts = await db.posts.count_documents(query)
-    posts_cursor = db.posts.find(query).sort("created_at", -1).skip(skip).limit(limit)
-    posts = await posts_cursor.to_list(length=limit)
-    for post in posts:
-        # Fetch likes and comments count
-        post["likes_count"] = await db.likes.count_documents({"post_id": post["_id"]})
-        post["comments_count"] = await db.comments.count_documents({"post_id": post["_id"]})
-    has_next = (skip + limit) < total_posts
-    has_prev = skip > 0
-    return templates.TemplateResponse(
+    page = await paginate(db.posts, query, limit, after=after, before=before, skip=skip)
+    total_posts = await cached_count(db.posts, query)
+    following = False
+    if user["_id"] != current_user.id:
+        following = await is_following(db, ObjectId(current_user.id), user["_id"])
+    return await _stream_page(
         "profile.html",
         {
             "request": request,
             "user": user,
-            "posts": posts,
+            "posts": page.items,
+            "total_posts": total_posts,
             "current_user": current_user,
-            "skip": skip,
+            "is_following": following,
             "limit": limit,
-            "has_next": has_next,
-            "has_prev": has_prev,
+            "has_next": page.has_next,
+            "has_prev": page.has_prev,
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor,
         },
+        page.items,
+        current_user,
+        key=key,
     )
 
 
@@ -191,27 +233,32 @@ async def create_post_form(
     current_user: User = Depends(get_current_user),
 ):
     db = get_database()
-    # Save image to static/images directory
-    images_dir = os.path.join(os.path.dirname(__file__), '..', 'static', 'images')
-    os.makedirs(images_dir, exist_ok=True)
-    image_path = os.path.join(images_dir, image.filename)
-    with open(image_path, "wb") as file:
-        contents = await image.read()
-        file.write(contents)
-    image_url = f"/static/images/{image.filename}"
+    # Stream the image to static/images under its content hash
+    image_url = await store_upload(image)
+    post_id = ObjectId()
     # Extract hashtags from caption
     hashtags = Post.extract_hashtags(caption)
     hashtags = [tag.lower().strip("#") for tag in hashtags]
     post_data = {
+        "_id": post_id,
         "caption": caption,
         "image_url": image_url,
         "category": category,
         "hashtags": hashtags,
         "user_id": ObjectId(current_user.id),
         "created_at": datetime.utcnow(),
+        "likes_count": 0,
+        "comments_count": 0,
+        # Fan-out, hashtag stats and image variants run as background jobs,
+        # saved by this same insert (see app/jobs.py)
+        "outbox": post_created_jobs(post_id),
     }
     result = await db.posts.insert_one(post_data)
-    logger.info(f"New post created by {current_user.username} (Post ID: {result.inserted_id})")
+    logger.info(
+        "New post created by %s (Post ID: %s)", current_user.username, result.inserted_id, extra={"event": "post"}
+    )
+    invalidate_new_post(post_data)
+    job_runner.notify()
     return RedirectResponse(url="/feed", status_code=303)
 
 
@@ -220,46 +267,35 @@ async def get_feed(
     request: Request,
     skip: int = Query(0, ge=0, description="Number of posts to skip"),
     limit: int = Query(10, ge=1, le=100, description="Number of posts to retrieve"),
+    after: Optional[str] = Query(None, description="Cursor of the last post on the previous page"),
+    before: Optional[str] = Query(None, description="Cursor of the first post on the next page"),
     current_user: User = Depends(get_current_user),
 ):
     db = get_database()
-    following_users = current_user.following
-    if following_users:
-        query = {"user_id": {"$in": following_users}}
-    else:
-        # Show user's own posts if not following anyone
-        query = {"user_id": ObjectId(current_user.id)}
     try:
-        # Correctly count the total number of posts matching the query
-        total_posts = await db.posts.count_documents(query)
-        # Fetch the posts with the applied query, sorting, skipping, and limiting
-        posts_cursor = db.posts.find(query).sort("created_at", -1).skip(skip).limit(limit)
-        posts = await posts_cursor.to_list(length=limit)
-        # Fetch usernames and compute likes and comments count for each post
-        for post in posts:
-            user = await db.users.find_one({"_id": post["user_id"]})
-            post["username"] = user["username"] if user else "Unknown"
-            # Get likes count
-            post["likes_count"] = await db.likes.count_documents({"post_id": post["_id"]})
-            # Get comments count
-            post["comments_count"] = await db.comments.count_documents({"post_id": post["_id"]})
-        # Calculate pagination details
-        has_next = (skip + limit) < total_posts
-        has_prev = skip > 0
-        return templates.TemplateResponse(
+        page = await read_feed(db, current_user, limit, after=after, before=before, skip=skip)
+        posts = page.items
+        # Fetch usernames in one batch; likes and comments counts are stored on the post
+        await attach_usernames(get_user_loader(request), posts)
+        return await _stream_page(
             "feed.html",
             {
                 "request": request,
                 "posts": posts,
                 "current_user": current_user,
-                "skip": skip,
                 "limit": limit,
-                "has_next": has_next,
-                "has_prev": has_prev,
+                "has_next": page.has_next,
+                "has_prev": page.has_prev,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor,
             },
+            posts,
+            current_user,
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching feed: {e}")
+        logger.error("Error fetching feed: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @router.get("/posts/", response_class=HTMLResponse)
@@ -267,37 +303,43 @@ async def list_all_posts(
     request: Request,
     skip: int = Query(0, ge=0, description="Number of posts to skip"),
     limit: int = Query(10, ge=1, le=100, description="Number of posts to retrieve"),
+    after: Optional[str] = Query(None, description="Cursor of the last post on the previous page"),
+    before: Optional[str] = Query(None, description="Cursor of the first post on the next page"),
     current_user: User = Depends(get_current_user),
 ):
+    key = page_key("posts", skip, limit, after, before)
+    cached_page = get_page(key)
+    if cached_page is not None:
+        return await _with_like_state(*cached_page, current_user)
     db = get_database()
     try:
-        total_posts = await db.posts.count_documents({})
-        posts_cursor = db.posts.find({}).sort("created_at", -1).skip(skip).limit(limit)
-        posts = await posts_cursor.to_list(length=limit)
-        
-        for post in posts:
-            user = await db.users.find_one({"_id": post["user_id"]})
-            post["username"] = user["username"] if user else "Unknown"
-            post["likes_count"] = await db.likes.count_documents({"post_id": post["_id"]})
-            post["comments_count"] = await db.comments.count_documents({"post_id": post["_id"]})
-        
-        has_next = (skip + limit) < total_posts
-        has_prev = skip > 0
-        
-        return templates.TemplateResponse(
+        page = await paginate(db.posts, {}, limit, after=after, before=before, skip=skip)
+        posts = page.items
+        await attach_usernames(get_user_loader(request), posts)
+        # Approximate total from collection metadata, no collection scan
+        total_posts = await cached_count(db.posts, {})
+
+        return await _stream_page(
             "list_posts.html",
             {
                 "request": request,
                 "posts": posts,
+                "total_posts": total_posts,
                 "current_user": current_user,
-                "skip": skip,
                 "limit": limit,
-                "has_next": has_next,
-                "has_prev": has_prev,
+                "has_next": page.has_next,
+                "has_prev": page.has_prev,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor,
             },
+            posts,
+            current_user,
+            key=key,
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error listing all posts: {e}")
+        logger.error("Error listing all posts: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -309,28 +351,21 @@ async def like_post_api(
 ):
     db = get_database()
     try:
-        post = await db.posts.find_one({"_id": ObjectId(post_id)})
+        post = await db.posts.find_one({"_id": ObjectId(post_id)}, {"_id": 1})
         if not post:
             error_message = "Post not found."
-            logger.warning(f"Like action failed: {error_message} Post ID: {post_id}")
+            logger.warning("Like action failed: %s Post ID: %s", error_message, post_id)
             raise HTTPException(status_code=404, detail=error_message)
-        existing_like = await db.likes.find_one({"post_id": post["_id"], "user_id": ObjectId(current_user.id)})
-        if existing_like:
-            # Unlike the post
-            await db.likes.delete_one({"_id": existing_like["_id"]})
-            logger.info(f"User {current_user.username} unliked post {post_id}.")
+        if await toggle_like(db, post, ObjectId(current_user.id)):
+            logger.info("User %s liked post %s.", current_user.username, post_id, extra={"event": "like"})
         else:
-            # Like the post
-            like_data = {
-                "user_id": ObjectId(current_user.id),
-                "post_id": post["_id"],
-                "created_at": datetime.utcnow(),
-            }
-            await db.likes.insert_one(like_data)
-            logger.info(f"User {current_user.username} liked post {post_id}.")
-        return RedirectResponse(url=f"/posts/{post_id}", status_code=303)
+            logger.info("User %s unliked post %s.", current_user.username, post_id, extra={"event": "like"})
+        # Like buttons live on listing pages; send the user back to where they clicked
+        referer = urlsplit(request.headers.get("referer", ""))
+        back = f"{referer.path}?{referer.query}" if referer.query else referer.path
+        return RedirectResponse(url=back or f"/posts/{post_id}", status_code=303)
     except Exception as e:
-        logger.error(f"Error liking/unliking post: {e}")
+        logger.error("Error liking/unliking post: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -346,19 +381,19 @@ async def comment_on_post_api(
         post = await db.posts.find_one({"_id": ObjectId(post_id)})
         if not post:
             error_message = "Post not found."
-            logger.warning(f"Comment action failed: {error_message} Post ID: {post_id}")
+            logger.warning("Comment action failed: %s Post ID: %s", error_message, post_id)
             raise HTTPException(status_code=404, detail=error_message)
-        comment_data = {
-            "text": text,
-            "user_id": ObjectId(current_user.id),
-            "post_id": post["_id"],
-            "created_at": datetime.utcnow(),
-        }
-        result = await db.comments.insert_one(comment_data)
-        logger.info(f"User {current_user.username} commented on post {post_id} (Comment ID: {result.inserted_id}).")
+        comment = await add_comment(db, post, ObjectId(current_user.id), text)
+        logger.info(
+            "User %s commented on post %s (Comment ID: %s).",
+            current_user.username,
+            post_id,
+            comment['_id'],
+            extra={"event": "comment"},
+        )
         return RedirectResponse(url=f"/posts/{post_id}", status_code=303)
     except Exception as e:
-        logger.error(f"Error adding comment: {e}")
+        logger.error("Error adding comment: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -371,41 +406,122 @@ async def follow_user_api(
     db = get_database()
     try:
         if str(current_user.id) == user_id:
-            logger.warning(f"User {current_user.username} attempted to follow/unfollow themselves.")
+            logger.warning("User %s attempted to follow/unfollow themselves.", current_user.username)
             return RedirectResponse(url=f"/profile/{user_id}", status_code=303)
-        target_user = await db.users.find_one({"_id": ObjectId(user_id)})
+        target_user = await db.users.find_one(
+            {"_id": ObjectId(user_id)}, {"username": 1, "followers_count": 1, "fanout_mode": 1}
+        )
         if not target_user:
             error_message = "User to follow/unfollow not found."
-            logger.warning(f"Follow action failed: {error_message} User ID: {user_id}")
+            logger.warning("Follow action failed: %s User ID: %s", error_message, user_id)
             raise HTTPException(status_code=404, detail=error_message)
-        if ObjectId(user_id) in current_user.following:
-            # Unfollow the user
-            await db.users.update_one(
-                {"_id": ObjectId(current_user.id)},
-                {"$pull": {"following": ObjectId(user_id)}},
-            )
-            await db.users.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$pull": {"followers": ObjectId(current_user.id)}},
+        if await toggle_follow(db, ObjectId(current_user.id), target_user):
+            logger.info(
+                "User %s followed user %s (ID: %s).",
+                current_user.username,
+                target_user['username'],
+                user_id,
+                extra={"event": "follow"},
             )
-            logger.info(f"User {current_user.username} unfollowed user {target_user['username']} (ID: {user_id}).")
         else:
-            # Follow the user
-            await db.users.update_one(
-                {"_id": ObjectId(current_user.id)},
-                {"$addToSet": {"following": ObjectId(user_id)}},
+            logger.info(
+                "User %s unfollowed user %s (ID: %s).",
+                current_user.username,
+                target_user['username'],
+                user_id,
+                extra={"event": "follow"},
             )
-            await db.users.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$addToSet": {"followers": ObjectId(current_user.id)}},
-            )
-            logger.info(f"User {current_user.username} followed user {target_user['username']} (ID: {user_id}).")
         return RedirectResponse(url=f"/profile/{user_id}", status_code=303)
     except Exception as e:
-        logger.error(f"Error following/unfollowing user: {e}")
+        logger.error("Error following/unfollowing user: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@router.get("/stats/cache", dependencies=[Depends(require_metrics_access)])
+async def get_cache_stats():
+    """
+    Hit/miss statistics for the in-process caches of this worker.
+    """
+    return {
+        "users": user_cache.stats(),
+        "counts": count_cache.stats(),
+        "pages": page_cache.stats(),
+        "fragments": fragment_cache.stats(),
+    }
+
+
+@router.get("/stats/hashing", dependencies=[Depends(require_metrics_access)])
+async def get_hashing_stats():
+    """
+    Queue depth and timing of password hashing on this worker.
+    """
+    return hashing_stats()
+
+
+@router.get("/stats/likes", dependencies=[Depends(require_metrics_access)])
+async def get_like_buffer_stats():
+    """
+    Buffered likes waiting for the next flush on this worker.
+    """
+    return like_buffer.stats()
+
+
+@router.get("/stats/jobs", dependencies=[Depends(require_metrics_access)])
+async def get_job_stats():
+    """
+    Background jobs: this worker's runner and the shared queue.
+    """
+    return {"worker": job_runner.stats(), "queue": await queue_stats()}
+
+
+@router.get("/stats/slow_queries", dependencies=[Depends(require_metrics_access)])
+async def get_slow_queries():
+    """
+    The most recent MongoDB commands over MONGO_SLOW_MS on this worker.
+    """
+    return list(slow_samples)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_metrics_access)])
+async def get_metrics():
+    """
+    Prometheus metrics for this worker: route latency, MongoDB commands per
+    request and per command, plus the cache, hashing, pool, like buffer, job and logging stats.
+    """
+    caches = [
+        ({"cache": "users"}, user_cache.stats()),
+        ({"cache": "counts"}, count_cache.stats()),
+        ({"cache": "pages"}, page_cache.stats()),
+        ({"cache": "fragments"}, fragment_cache.stats()),
+    ]
+    return PlainTextResponse(render_metrics({
+        "instapy_cache": caches,
+        "instapy_hashing": [({}, hashing_stats())],
+        "instapy_mongo_pool": [({}, pool_stats.snapshot())],
+        "instapy_like_buffer": [({}, like_buffer.stats())],
+        "instapy_jobs": [({}, job_runner.stats())],
+        "instapy_logging": [({}, logging_stats())],
+    }), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/healthz")
+async def healthz():
+    """
+    Liveness: the worker is up. Reports pool utilization without touching MongoDB.
+    """
+    return await health(check_server=False)
+
+
+@router.get("/readyz")
+async def readyz():
+    """
+    Readiness: 200 once the connection pool is warm and MongoDB answers a
+    ping, 503 otherwise, with the round-trip latency.
+    """
+    status = await health(check_server=True)
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
 # ---------- BONUS FEATURES START HERE ----------
 
 # 1. Search Users by Username (Substring Search)
@@ -413,8 +529,9 @@ async def follow_user_api(
 async def search_users(
     request: Request,
     q: Optional[str] = Query(None, min_length=1, description="Search query for usernames"),
-    skip: int = Query(0, ge=0, description="Number of users to skip"),
     limit: int = Query(10, ge=1, le=100, description="Number of users to retrieve"),
+    after: Optional[str] = Query(None, description="Cursor of the last user on the previous page"),
+    before: Optional[str] = Query(None, description="Cursor of the first user on the next page"),
     current_user: User = Depends(get_current_user),
 ):
     db = get_database()
@@ -425,28 +542,26 @@ async def search_users(
                 "search_users.html",
                 {"request": request, "users": None, "current_user": current_user},
             )
-        # Case-insensitive substring search
-        query = {"username": {"$regex": q, "$options": "i"}}
-        total_users = await db.users.count_documents(query)
-        users_cursor = db.users.find(query).skip(skip).limit(limit)
-        users = await users_cursor.to_list(length=limit)
-        has_next = (skip + limit) < total_users
-        has_prev = skip > 0
+        # Ranked, index-backed search: exact, then prefix, then substring matches
+        page = await search_usernames(db, q, limit, after=after, before=before)
         return templates.TemplateResponse(
             "search_users.html",
             {
                 "request": request,
-                "users": users,
+                "users": page.items,
                 "query": q,
-                "skip": skip,
                 "limit": limit,
-                "has_next": has_next,
-                "has_prev": has_prev,
+                "has_next": page.has_next,
+                "has_prev": page.has_prev,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor,
                 "current_user": current_user,
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error searching users: {e}")
+        logger.error("Error searching users: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -457,6 +572,8 @@ async def search_posts(
     hashtag: Optional[str] = Query(None, min_length=1, description="Hashtag to search for (without #)"),
     skip: int = Query(0, ge=0, description="Number of posts to skip"),
     limit: int = Query(10, ge=1, le=100, description="Number of posts to retrieve"),
+    after: Optional[str] = Query(None, description="Cursor of the last post on the previous page"),
+    before: Optional[str] = Query(None, description="Cursor of the first post on the next page"),
     current_user: User = Depends(get_current_user),
     category: Optional[str] = Query(None, description="Filter by category"),
     start_date: Optional[datetime] = Query(None, description="Start date for date filter"),
@@ -478,33 +595,18 @@ async def search_posts(
                     "current_user": current_user,
                 },
             )
-        # Build the query
-        query = {"hashtags": {"$in": [hashtag.lower()]}}
-        # Apply category filter if provided
-        if category:
-            query["category"] = category
-        # Apply date filters if provided
-        if start_date and end_date:
-            query["created_at"] = {"$gte": start_date, "$lte": end_date}
-        elif start_date:
-            query["created_at"] = {"$gte": start_date}
-        elif end_date:
-            query["created_at"] = {"$lte": end_date}
-        total_posts = await db.posts.count_documents(query)
-        posts_cursor = db.posts.find(query).sort("created_at", -1).skip(skip).limit(limit)
-        posts = await posts_cursor.to_list(length=limit)
-        # Fetch usernames and compute likes and comments count for each post
-        for post in posts:
-            user = await db.users.find_one({"_id": post["user_id"]})
-            post["username"] = user["username"] if user else "Unknown"
-            # Get likes count
-            post["likes_count"] = await db.likes.count_documents({"post_id": post["_id"]})
-            # Get comments count
-            post["comments_count"] = await db.comments.count_documents({"post_id": post["_id"]})
-        # Calculate pagination details
-        has_next = (skip + limit) < total_posts
-        has_prev = skip > 0
-        return templates.TemplateResponse(
+        key = page_key(
+            f"hashtag:{hashtag.lower()}", hashtag, category, start_date, end_date, skip, limit, after, before
+        )
+        cached_page = get_page(key)
+        if cached_page is not None:
+            return await _with_like_state(*cached_page, current_user)
+        query = hashtag_search_query(hashtag, category, start_date, end_date)
+        page = await paginate(db.posts, query, limit, after=after, before=before, skip=skip)
+        posts = page.items
+        # Fetch usernames in one batch; likes and comments counts are stored on the post
+        await attach_usernames(get_user_loader(request), posts)
+        return await _stream_page(
             "search_posts.html",
             {
                 "request": request,
@@ -513,15 +615,21 @@ async def search_posts(
                 "category": category,
                 "start_date": start_date.strftime("%Y-%m-%d") if start_date else "",
                 "end_date": end_date.strftime("%Y-%m-%d") if end_date else "",
-                "skip": skip,
                 "limit": limit,
-                "has_next": has_next,
-                "has_prev": has_prev,
+                "has_next": page.has_next,
+                "has_prev": page.has_prev,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor,
                 "current_user": current_user,
             },
+            posts,
+            current_user,
+            key=key,
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error searching posts: {e}")
+        logger.error("Error searching posts: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -532,6 +640,8 @@ async def get_post_likes(
     post_id: str,
     skip: int = Query(0, ge=0, description="Number of likes to skip"),
     limit: int = Query(10, ge=1, le=100, description="Number of likes to retrieve"),
+    after: Optional[str] = Query(None, description="Cursor of the last like on the previous page"),
+    before: Optional[str] = Query(None, description="Cursor of the first like on the next page"),
     current_user: User = Depends(get_current_user),
 ):
     db = get_database()
@@ -539,31 +649,33 @@ async def get_post_likes(
         post = await db.posts.find_one({"_id": ObjectId(post_id)})
         if not post:
             error_message = "Post not found."
-            logger.warning(f"Like listing failed: {error_message} Post ID: {post_id}")
+            logger.warning("Like listing failed: %s Post ID: %s", error_message, post_id)
             raise HTTPException(status_code=404, detail=error_message)
-        total_likes = await db.likes.count_documents({"post_id": post["_id"]})
-        likes_cursor = db.likes.find({"post_id": post["_id"]}).skip(skip).limit(limit)
-        likes = await likes_cursor.to_list(length=limit)
+        page = await paginate(
+            db.likes, {"post_id": post["_id"]}, limit, after=after, before=before, skip=skip
+        )
+        likes = page.items
         user_ids = [like["user_id"] for like in likes]
-        users_cursor = db.users.find({"_id": {"$in": user_ids}})
-        users = await users_cursor.to_list(length=len(user_ids))
-        has_next = (skip + limit) < total_likes
-        has_prev = skip > 0
+        users_by_id = await get_user_loader(request).load_many(user_ids)
+        users = [users_by_id[user_id] for user_id in user_ids if users_by_id[user_id]]
         return templates.TemplateResponse(
             "post_likes.html",
             {
                 "request": request,
                 "users": users,
                 "post": post,
-                "skip": skip,
                 "limit": limit,
-                "has_next": has_next,
-                "has_prev": has_prev,
+                "has_next": page.has_next,
+                "has_prev": page.has_prev,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor,
                 "current_user": current_user,
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching post likes: {e}")
+        logger.error("Error fetching post likes: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
@@ -574,6 +686,8 @@ async def get_post_comments(
     post_id: str,
     skip: int = Query(0, ge=0, description="Number of comments to skip"),
     limit: int = Query(10, ge=1, le=100, description="Number of comments to retrieve"),
+    after: Optional[str] = Query(None, description="Cursor of the last comment on the previous page"),
+    before: Optional[str] = Query(None, description="Cursor of the first comment on the next page"),
     current_user: User = Depends(get_current_user),
 ):
     db = get_database()
@@ -581,48 +695,78 @@ async def get_post_comments(
         post = await db.posts.find_one({"_id": ObjectId(post_id)})
         if not post:
             error_message = "Post not found."
-            logger.warning(f"Comment listing failed: {error_message} Post ID: {post_id}")
+            logger.warning("Comment listing failed: %s Post ID: %s", error_message, post_id)
             raise HTTPException(status_code=404, detail=error_message)
-        total_comments = await db.comments.count_documents({"post_id": post["_id"]})
-        comments_cursor = db.comments.find({"post_id": post["_id"]}).sort("created_at", -1).skip(skip).limit(limit)
-        comments = await comments_cursor.to_list(length=limit)
-        user_ids = [comment["user_id"] for comment in comments]
-        users_cursor = db.users.find({"_id": {"$in": user_ids}})
-        users = await users_cursor.to_list(length=len(user_ids))
-        user_dict = {user["_id"]: user["username"] for user in users}
+        page = await paginate(
+            db.comments, {"post_id": post["_id"]}, limit, after=after, before=before, skip=skip
+        )
+        comments = page.items
+        await attach_usernames(get_user_loader(request), comments)
         comments_with_users = []
         for comment in comments:
             comments_with_users.append({
                 "id": str(comment["_id"]),
                 "text": comment["text"],
                 "created_at": comment["created_at"],
-                "username": user_dict.get(comment["user_id"], "Unknown"),
+                "username": comment["username"],
             })
-        has_next = (skip + limit) < total_comments
-        has_prev = skip > 0
         return templates.TemplateResponse(
             "post_comments.html",
             {
                 "request": request,
                 "comments": comments_with_users,
                 "post": post,
-                "skip": skip,
                 "limit": limit,
-                "has_next": has_next,
-                "has_prev": has_prev,
+                "has_next": page.has_next,
+                "has_prev": page.has_prev,
+                "next_cursor": page.next_cursor,
+                "prev_cursor": page.prev_cursor,
                 "current_user": current_user,
             },
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching post comments: {e}")
+        logger.error("Error fetching post comments: %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
-# 5. Search Users by Username (Already Implemented Above)
+# 5. Hashtag Autocomplete and Top Hashtags (served from the in-memory hashtag index)
+@router.get("/hashtags/autocomplete")
+async def autocomplete_hashtags(
+    q: str = Query("", max_length=100, description="Hashtag prefix (with or without #)"),
+    limit: int = Query(10, ge=1, le=50, description="Number of suggestions to return"),
+):
+    suggestions = get_hashtag_index().suggest(q, limit)
+    return [{"hashtag": tag, "count": count} for tag, count in suggestions]
+
+
+@router.get("/hashtags/top", response_class=HTMLResponse)
+async def top_hashtags(
+    request: Request,
+    window: str = Query("all", description="Time window: all, 24h or 7d"),
+    limit: int = Query(50, ge=1, le=100, description="Number of hashtags to show"),
+    current_user: User = Depends(get_current_user),
+):
+    if window != "all" and window not in WINDOWS:
+        raise HTTPException(status_code=400, detail="Unknown time window.")
+    return templates.TemplateResponse(
+        "top_hashtags.html",
+        {
+            "request": request,
+            "hashtags": get_hashtag_index().top_hashtags(window, limit),
+            "window": window,
+            "windows": ["all"] + list(WINDOWS),
+            "current_user": current_user,
+        },
+    )
+
+
+# 6. Search Users by Username (Already Implemented Above)
 # (This comment is to indicate that the feature is implemented above)
 
 
-# 6. Search Posts by Hashtags with Pagination and Filters (Already Implemented Above)
+# 7. Search Posts by Hashtags with Pagination and Filters (Already Implemented Above)
 # (This comment is to indicate that the feature is implemented above)
 
 
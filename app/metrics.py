@@ -0,0 +1,363 @@
+# app/metrics.py
+
+import os
+import hmac
+import time
+import logging
+import ipaddress
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from pymongo.monitoring import CommandListener
+
+logger = logging.getLogger("app.metrics")
+
+# MongoDB commands slower than this many milliseconds are kept as samples.
+MONGO_SLOW_MS = float(os.getenv("MONGO_SLOW_MS", "100"))
+SLOW_SAMPLE_SIZE = int(os.getenv("SLOW_SAMPLE_SIZE", "100"))
+# MongoDB commands a request may issue before it is reported. Routes can be
+# given their own budget, e.g. QUERY_BUDGETS="/feed=12,/posts/{post_id}=6".
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "25"))
+QUERY_BUDGETS = {
+    route.strip(): int(budget)
+    for route, _, budget in (
+        item.rpartition("=") for item in os.getenv("QUERY_BUDGETS", "").split(",") if "=" in item
+    )
+}
+# What an over-budget request does: "log" a warning, "raise" (for test runs,
+# so N+1 regressions fail the suite) or "off".
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "log").lower()
+# Adds an X-Mongo-Commands response header with the request's command count.
+MONGO_COMMAND_HEADER = os.getenv("MONGO_COMMAND_HEADER", "0") == "1"
+# Bearer token required by /metrics and /stats/*. Without one they only
+# answer direct requests from the same host.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+# Longest filter shape kept in a slow-query sample.
+SAMPLE_COMMAND_CHARS = 500
+# Where each command keeps its filter. update and delete hold a list of
+# statements, each with its filter under "q".
+FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "aggregate": "pipeline",
+}
+STATEMENT_FIELDS = {"update": "updates", "delete": "deletes"}
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def _shape(value):
+    """
+    The structure of a filter with every value replaced by "?", so samples
+    never hold user data such as emails or password hashes.
+    """
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = _shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+def command_shape(command_name: str, command: dict) -> dict:
+    """
+    The collection and redacted filter of a command, for slow-query samples.
+    Inserted documents and update contents are left out entirely.
+    """
+    collection = command.get(command_name)
+    shape = {"collection": collection if isinstance(collection, str) else None}
+    if command_name in FILTER_FIELDS:
+        shape["filter"] = _shape(command.get(FILTER_FIELDS[command_name], {}))
+    elif command_name in STATEMENT_FIELDS:
+        statements = command.get(STATEMENT_FIELDS[command_name], [])
+        shape["filter"] = _shape([statement.get("q", {}) for statement in statements])
+    return shape
+
+
+class RequestStats:
+    """
+    MongoDB commands issued on behalf of one request. Motor runs commands in
+    its thread pool with a copy of the request's context, so the listener
+    finds this object there; list.append keeps concurrent updates safe.
+    """
+
+    __slots__ = ("scope", "commands")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.commands = []
+
+    @property
+    def route(self) -> str:
+        """
+        The matched route template (e.g. /posts/{post_id}, so ids don't
+        become labels). Mounts such as /static leave only their root_path.
+        """
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("root_path") or "unmatched"
+
+    @property
+    def count(self) -> int:
+        return len(self.commands)
+
+    @property
+    def seconds(self) -> float:
+        return sum(duration for _, duration in self.commands)
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(series):
+            label_text = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("route", "method", "status"), LATENCY_BUCKETS
+)
+request_commands = Histogram(
+    "http_request_mongo_commands", "MongoDB commands issued per request.", ("route", "method"), COMMAND_COUNT_BUCKETS
+)
+command_latency = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency.", ("command",), LATENCY_BUCKETS
+)
+command_failures = Counter("mongo_command_failures_total", "Failed MongoDB commands.", ("command",))
+slow_commands = Counter("mongo_slow_commands_total", f"MongoDB commands slower than {MONGO_SLOW_MS} ms.", ("command",))
+budget_exceeded = Counter(
+    "http_request_query_budget_exceeded_total", "Requests over their MongoDB command budget.", ("route",)
+)
+slow_samples = deque(maxlen=SLOW_SAMPLE_SIZE)
+
+
+class CommandMetrics(CommandListener):
+    """
+    Times every MongoDB command and charges it to the current request.
+    """
+
+    def __init__(self):
+        # request_id -> started event, for the command document of slow commands.
+        self._started = {}
+
+    def started(self, event):
+        self._started[event.request_id] = event
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        started = self._started.pop(event.request_id, None)
+        seconds = event.duration_micros / 1e6
+        command_latency.observe((event.command_name,), seconds)
+        if failed:
+            command_failures.inc((event.command_name,))
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.commands.append((event.command_name, seconds))
+        if seconds * 1000 >= MONGO_SLOW_MS:
+            slow_commands.inc((event.command_name,))
+            shape = command_shape(event.command_name, started.command) if started is not None else {}
+            slow_samples.append({
+                "command": event.command_name,
+                "database": event.database_name,
+                "collection": shape.get("collection"),
+                "filter": str(shape["filter"])[:SAMPLE_COMMAND_CHARS] if "filter" in shape else None,
+                "duration_ms": round(seconds * 1000, 3),
+                "route": stats.route if stats is not None else None,
+                "failed": failed,
+                "at": time.time(),
+            })
+
+
+command_metrics = CommandMetrics()
+
+
+def _is_local(request: Request) -> bool:
+    # A proxy in front of the app connects from the same host, so forwarded
+    # requests never count as local.
+    if request.client is None or "x-forwarded-for" in request.headers or "forwarded" in request.headers:
+        return False
+    try:
+        return ipaddress.ip_address(request.client.host).is_loopback
+    except ValueError:
+        return False
+
+
+def require_metrics_access(request: Request):
+    """
+    Guards /metrics and /stats/*: a bearer METRICS_TOKEN when one is set,
+    otherwise direct requests from the same host only.
+    """
+    if METRICS_TOKEN:
+        if hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+            return
+    elif _is_local(request):
+        return
+    raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def query_budget(route: str) -> int:
+    return QUERY_BUDGETS.get(route, QUERY_BUDGET)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency and MongoDB command counts per route template and
+    enforces the per-route query budget.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if MONGO_COMMAND_HEADER:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-mongo-commands", str(stats.count).encode())
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            method = scope["method"]
+            route = stats.route
+            request_latency.observe((route, method, str(status)), time.perf_counter() - started)
+            request_commands.observe((route, method), stats.count)
+        self._check_budget(stats, method)
+
+    def _check_budget(self, stats: RequestStats, method: str):
+        budget = query_budget(stats.route)
+        if QUERY_BUDGET_MODE == "off" or stats.count <= budget:
+            return
+        budget_exceeded.inc((stats.route,))
+        message = (
+            f"{method} {stats.route} ran {stats.count} MongoDB commands "
+            f"({stats.seconds * 1000:.1f} ms), over its budget of {budget}."
+        )
+        if QUERY_BUDGET_MODE == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def _gauge_lines(name: str, rows: list) -> list:
+    """
+    Prometheus gauges from stats dicts: one metric per numeric field, one
+    series per (labels, stats) row.
+    """
+    fields = {}
+    for labels, stats in rows:
+        for field, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                fields.setdefault(field, []).append((labels, value))
+    lines = []
+    for field, series in fields.items():
+        metric = f"{name}_{field}"
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in series:
+            label_text = _labels(tuple(labels), tuple(labels.values()))
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+    return lines
+
+
+def render_metrics(gauges: dict) -> str:
+    """
+    The Prometheus text exposition of this worker's metrics. `gauges` maps
+    a metric prefix to (labels, stats dict) rows to expose alongside them.
+    """
+    lines = []
+    for metric in (request_latency, request_commands, command_latency, command_failures, slow_commands, budget_exceeded):
+        lines.extend(metric.render())
+    for name, rows in gauges.items():
+        lines.extend(_gauge_lines(name, rows))
+    return "\n".join(lines) + "\n"
@@ -27,8 +27,9 @@ class User(BaseModel):
     username: str
     email: str
     password: str
-    following: List[PyObjectId] = []
-    followers: List[PyObjectId] = []
+    following_count: int = 0
+    followers_count: int = 0
+    fanout_mode: Optional[str] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -38,8 +39,8 @@ class User(BaseModel):
                 "username": "spandan",
                 "email": "spandan@example.com",
                 "password": "hashed_password",
-                "following": [],
-                "followers": [],
+                "following_count": 0,
+                "followers_count": 0,
             }
         }
 
@@ -0,0 +1,131 @@
+# app/page_cache.py
+
+import os
+import re
+import threading
+from typing import Callable, Hashable, Iterable, Optional
+
+from fastapi.responses import HTMLResponse
+from jinja2 import pass_environment
+from markupsafe import Markup
+
+from app.cache import TTLCache
+
+# Rendered public listing pages (all posts, hashtag search, profiles).
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "2000"))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "60"))
+# Rendered list items, one per post, shared by every listing that shows the post.
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "20000"))
+FRAGMENT_CACHE_TTL = float(os.getenv("FRAGMENT_CACHE_TTL", "600"))
+
+POST_FRAGMENT = "post_item.html"
+# Placeholder for the like button label in post fragments, e.g. <!--liked:64f0...-->.
+# Fragments and pages are shared by all viewers; the label is filled per request.
+LIKE_SLOT = re.compile(r"<!--liked:([0-9a-f]{24})-->")
+
+page_cache = TTLCache(maxsize=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL)
+fragment_cache = TTLCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL)
+# Post id -> keys of the cached pages that display it, so a like or comment
+# only drops the pages it actually changes.
+_pages_by_post = TTLCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=PAGE_CACHE_TTL)
+# Scope -> generation. Page keys embed the generation of their scope, so
+# bumping it retires every page of that listing at once.
+_generations = {}
+_lock = threading.Lock()
+
+
+def page_key(scope: str, *parts: Hashable) -> tuple:
+    """
+    Cache key for one page of a listing. `parts` must cover everything the
+    page depends on: pagination parameters, filters and, for pages that
+    differ per viewer, the viewer's id.
+    """
+    return (scope, _generations.get(scope, 0)) + parts
+
+
+def bump_generation(*scopes: str):
+    with _lock:
+        for scope in scopes:
+            _generations[scope] = _generations.get(scope, 0) + 1
+
+
+def get_page(key: tuple) -> Optional[tuple]:
+    """
+    Returns the cached (html, post_ids) for `key`, or None.
+    """
+    return page_cache.get(key)
+
+
+def store_page(key: tuple, html: str, post_ids: Iterable):
+    """
+    Stores a rendered page under `key` and records which posts it shows for
+    invalidation.
+    """
+    post_ids = list(post_ids)
+    page_cache.set(key, (html, post_ids))
+    with _lock:
+        for post_id in post_ids:
+            post_id = str(post_id)
+            keys = _pages_by_post.get(post_id) or set()
+            keys.add(key)
+            _pages_by_post.set(post_id, keys)
+
+
+def like_slot_filler(liked_ids: set) -> Callable[[str], str]:
+    """
+    Returns a function that fills the viewer-specific like buttons left open
+    in shared fragments. Each fragment is rendered in one piece, so streamed
+    chunks never split a slot.
+    """
+    liked = {str(post_id) for post_id in liked_ids}
+    return lambda html: LIKE_SLOT.sub(lambda match: "Unlike" if match.group(1) in liked else "Like", html)
+
+
+def fill_like_slots(html: str, liked_ids: set) -> HTMLResponse:
+    return HTMLResponse(like_slot_filler(liked_ids)(html))
+
+
+def invalidate_post(post_id):
+    """
+    Drops every cached page showing a changed post. Its fragments need no
+    invalidation: their key holds the fields that change.
+    """
+    post_id = str(post_id)
+    with _lock:
+        keys = _pages_by_post.get(post_id) or set()
+        _pages_by_post.invalidate(post_id)
+    for key in keys:
+        page_cache.invalidate(key)
+
+
+def invalidate_new_post(post: dict):
+    """
+    Retires the listings a new post appears in: all posts, the author's
+    profile and the search results of each of its hashtags.
+    """
+    bump_generation("posts", f"profile:{post['user_id']}", *(f"hashtag:{tag}" for tag in post["hashtags"]))
+
+
+def invalidate_profile(user_id):
+    bump_generation(f"profile:{user_id}")
+
+
+@pass_environment
+def render_post(environment, post: dict, show_author: bool = True) -> Markup:
+    """
+    Template helper returning the cached list item for a post. The key holds
+    the post's mutable fields, so a post read fresh from MongoDB on any
+    worker misses stale fragments rather than needing them invalidated.
+    """
+    key = (
+        str(post["_id"]),
+        show_author,
+        post.get("likes_count", 0),
+        post.get("comments_count", 0),
+        bool(post.get("image_variants")),
+    )
+    html = fragment_cache.get(key)
+    if html is None:
+        html = environment.get_template(POST_FRAGMENT).render(post=post, show_author=show_author)
+        fragment_cache.set(key, html)
+    return Markup(html)
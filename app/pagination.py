@@ -0,0 +1,128 @@
+# app/pagination.py
+
+import os
+import base64
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from bson import json_util
+from fastapi import HTTPException
+
+from app.cache import TTLCache
+
+# Newest first, with _id as a tie-breaker for posts created in the same millisecond.
+NEWEST_FIRST = [("created_at", -1), ("_id", -1)]
+
+# Totals shown next to listings; a few seconds of staleness is fine for display.
+count_cache = TTLCache(
+    maxsize=int(os.getenv("COUNT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("COUNT_CACHE_TTL", "15")),
+)
+
+
+@dataclass
+class Page:
+    items: List[dict] = field(default_factory=list)
+    has_next: bool = False
+    has_prev: bool = False
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+def encode_cursor(values: list) -> str:
+    raw = json_util.dumps(values).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    return values
+
+
+def cursor_for(document: dict, sort: list) -> str:
+    return encode_cursor([document[name] for name, _ in sort])
+
+
+def keyset_filter(sort: list, values: list, reverse: bool = False) -> dict:
+    """
+    Builds the filter selecting documents strictly after `values` in `sort`
+    order (or strictly before them when `reverse` is set).
+    """
+    clauses = []
+    for index, (name, direction) in enumerate(sort):
+        ascending = (direction == 1) != reverse
+        clause = {prev_name: values[i] for i, (prev_name, _) in enumerate(sort[:index])}
+        clause[name] = {"$gt" if ascending else "$lt": values[index]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+async def cached_count(collection, query: dict) -> int:
+    """
+    Total number of documents matching `query`, for display only. Unfiltered
+    totals use collection metadata; filtered ones are cached for COUNT_CACHE_TTL.
+    """
+    if not query:
+        return await collection.estimated_document_count()
+    key = (collection.name, json_util.dumps(query, sort_keys=True))
+    total = count_cache.get(key)
+    if total is None:
+        total = await collection.count_documents(query)
+        count_cache.set(key, total)
+    return total
+
+
+def _merge(query: dict, extra: dict) -> dict:
+    if not query:
+        return extra
+    return {"$and": [query, extra]}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    limit: int,
+    sort: list = NEWEST_FIRST,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    skip: int = 0,
+    projection: Optional[dict] = None,
+) -> Page:
+    """
+    Fetches one page of `collection` ordered by `sort`.
+
+    `after` / `before` are opaque cursors taken from a previous page and use a
+    keyset range on the sort fields, so the cost of a page does not depend on
+    how deep it is. `skip` is only honoured when no cursor is given, for old
+    links that still use offset pagination. Every mode fetches `limit + 1`
+    rows to decide `has_next`, so no count query is needed.
+    """
+    if after or before:
+        reverse = bool(before)
+        values = decode_cursor(before if reverse else after, len(sort))
+        find_sort = [(name, -direction) for name, direction in sort] if reverse else sort
+        cursor = collection.find(_merge(query, keyset_filter(sort, values, reverse)), projection)
+        items = await cursor.sort(find_sort).limit(limit + 1).to_list(length=limit + 1)
+        more = len(items) > limit
+        items = items[:limit]
+        if reverse:
+            items.reverse()
+            page = Page(items=items, has_next=True, has_prev=more)
+        else:
+            page = Page(items=items, has_next=more, has_prev=True)
+    else:
+        cursor = collection.find(query, projection).sort(sort).skip(skip).limit(limit + 1)
+        items = await cursor.to_list(length=limit + 1)
+        page = Page(items=items[:limit], has_next=len(items) > limit, has_prev=skip > 0)
+    if page.items:
+        if page.has_next:
+            page.next_cursor = cursor_for(page.items[-1], sort)
+        if page.has_prev:
+            page.prev_cursor = cursor_for(page.items[0], sort)
+    return page
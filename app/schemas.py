@@ -1,8 +1,9 @@
 # app/schemas.py
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, conlist, constr
 from typing import List, Optional
 from datetime import datetime
+from app.follows import BULK_FOLLOW_LIMIT
 from app.models import PyObjectId
 
 class UserCreateSchema(BaseModel):
@@ -18,8 +19,17 @@ class UserSchema(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     username: str
     email: EmailStr
-    following: List[str] = []
-    followers: List[str] = []
+    following_count: int = 0
+    followers_count: int = 0
+
+    class Config:
+        allow_population_by_field_name = True
+        arbitrary_types_allowed = True
+        json_encoders = {PyObjectId: str}
+
+class UserSummarySchema(BaseModel):
+    id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
+    username: str
 
     class Config:
         allow_population_by_field_name = True
@@ -40,12 +50,23 @@ class PostSchema(BaseModel):
     created_at: datetime
     user_id: str
     username: str
+    likes_count: int = 0
+    comments_count: int = 0
+    image_variants: Optional[dict] = None
+    liked: bool = False
 
     class Config:
         allow_population_by_field_name = True
         arbitrary_types_allowed = True
         json_encoders = {PyObjectId: str}
 
+class CommentCreateSchema(BaseModel):
+    text: constr(min_length=1, max_length=500)
+
+class BulkFollowSchema(BaseModel):
+    follow: conlist(str, max_items=BULK_FOLLOW_LIMIT) = []
+    unfollow: conlist(str, max_items=BULK_FOLLOW_LIMIT) = []
+
 class CommentSchema(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     text: str
@@ -63,6 +84,8 @@ class LikeSchema(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     user_id: str
     post_id: str
+    created_at: datetime
+    username: str
 
     class Config:
         allow_population_by_field_name = True
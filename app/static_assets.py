@@ -0,0 +1,159 @@
+# app/static_assets.py
+
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+import threading
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), '..', 'static')
+STATIC_URL = "/static"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+FINGERPRINT_LENGTH = 12
+
+# Uploads are stored as <sha256>[_variant].<ext>, so their URLs are fingerprints already.
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(_[a-z0-9_]+)?\.[a-z0-9]+$")
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".html", ".txt", ".json"}
+# Preferred order when the client accepts several encodings.
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(full_path: str, stat_result: os.stat_result) -> str:
+    """
+    SHA-256 of a file's contents, memoized until its mtime or size changes.
+    """
+    key = (full_path, stat_result.st_mtime_ns, stat_result.st_size)
+    digest = _digests.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(full_path, "rb") as file:
+            for chunk in iter(lambda: file.read(64 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+
+def static_url(path: str) -> str:
+    """
+    Template helper returning a fingerprinted URL for a file under static/,
+    e.g. static_url('css/styles.css') -> /static/css/styles.css?v=3f2a9c...
+    """
+    full_path = os.path.join(STATIC_DIR, path)
+    try:
+        stat_result = os.stat(full_path)
+    except FileNotFoundError:
+        return f"{STATIC_URL}/{path}"
+    digest = file_digest(full_path, stat_result)
+    return f"{STATIC_URL}/{path}?v={digest[:FINGERPRINT_LENGTH]}"
+
+
+def _accepted_encodings(request_headers: Headers) -> set:
+    accepted = set()
+    for item in request_headers.get("accept-encoding", "").split(","):
+        encoding, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with far-future caching for fingerprinted URLs, strong
+    content-hash ETags and precompressed .br/.gz variants.
+    """
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        name = os.path.basename(full_path)
+        if CONTENT_ADDRESSED.match(name):
+            etag = os.path.splitext(name)[0]
+            fingerprinted = True
+        else:
+            digest = file_digest(str(full_path), stat_result)
+            etag = digest[:32]
+            version = QueryParams(scope.get("query_string", b"")).get("v")
+            fingerprinted = version == digest[:FINGERPRINT_LENGTH]
+
+        headers = {"Cache-Control": IMMUTABLE if fingerprinted else REVALIDATE}
+        media_type = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+        serve_path, serve_stat = full_path, stat_result
+        if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = _accepted_encodings(request_headers)
+            for encoding, suffix in PRECOMPRESSED:
+                if encoding not in accepted:
+                    continue
+                try:
+                    compressed_stat = os.stat(f"{full_path}{suffix}")
+                except FileNotFoundError:
+                    continue
+                # Ignore stale compressed copies left over from an older build.
+                if compressed_stat.st_mtime_ns < stat_result.st_mtime_ns:
+                    continue
+                serve_path, serve_stat = f"{full_path}{suffix}", compressed_stat
+                headers["Content-Encoding"] = encoding
+                etag = f"{etag}-{encoding}"
+                break
+        headers["ETag"] = f'"{etag}"'
+
+        response = FileResponse(
+            serve_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=serve_stat,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def precompress_static(directory: str = STATIC_DIR) -> int:
+    """
+    Writes .gz (and .br when the brotli package is installed) copies of every
+    compressible file under static/. Run as part of a deploy.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    written = 0
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(root, filename)
+            with open(path, "rb") as file:
+                data = file.read()
+            with open(f"{path}.gz", "wb") as file:
+                file.write(gzip.compress(data, compresslevel=9, mtime=0))
+            written += 1
+            if brotli is not None:
+                with open(f"{path}.br", "wb") as file:
+                    file.write(brotli.compress(data))
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    print(f"Wrote {precompress_static()} precompressed files.")
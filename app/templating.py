@@ -0,0 +1,100 @@
+# app/templating.py
+
+import os
+import time
+import logging
+from typing import Callable, Iterator, Optional
+
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from app.page_cache import render_post
+from app.static_assets import static_url
+
+logger = logging.getLogger("app.templating")
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')
+# Re-check template files for changes on every render. For development only.
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "0") == "1"
+# Compiled template bytecode, reused across restarts and by every worker.
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join("data", "jinja_cache"))
+# Streamed pages are sent in pieces of at least this many characters.
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "8192"))
+
+
+def _bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning("Template bytecode cache disabled, cannot create %s: %s", TEMPLATE_CACHE_DIR, e)
+        return None
+    return FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+
+# The one Jinja environment every route renders with.
+environment = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=True,
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    bytecode_cache=_bytecode_cache(),
+)
+environment.globals["static_url"] = static_url
+environment.globals["render_post"] = render_post
+
+templates = Jinja2Templates(env=environment)
+
+
+def precompile_templates() -> int:
+    """
+    Compiles every template into the environment's cache at startup, so no
+    request pays for parsing. Bytecode written by an earlier run is reused.
+    """
+    started = time.perf_counter()
+    names = environment.list_templates(extensions=["html"])
+    for name in names:
+        environment.get_template(name)
+    logger.info("Precompiled %s templates in %.3fs.", len(names), time.perf_counter() - started)
+    return len(names)
+
+
+def _chunks(pieces: Iterator[str]) -> Iterator[str]:
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_template(
+    name: str,
+    context: dict,
+    transform: Optional[Callable[[str], str]] = None,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> StreamingResponse:
+    """
+    Sends a template as it renders via Template.generate, so the page head
+    and the first posts leave before the last ones are rendered. Each chunk
+    passes through `transform` on its way out; `on_complete` gets the whole
+    untransformed page once it has been sent, e.g. to cache it.
+    """
+    template = environment.get_template(name)
+
+    def body():
+        rendered = []
+        for chunk in _chunks(template.generate(context)):
+            if on_complete is not None:
+                rendered.append(chunk)
+            yield transform(chunk) if transform is not None else chunk
+        if on_complete is not None:
+            on_complete("".join(rendered))
+
+    # Starlette iterates a sync generator in its threadpool, so rendering
+    # does not block the event loop.
+    return StreamingResponse(body(), media_type="text/html; charset=utf-8")
@@ -0,0 +1,284 @@
+# app/timeline.py
+
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from typing import Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.auth import invalidate_cached_user
+from app.database import get_database
+from app.follows import followed_among, follower_id_batches
+from app.pagination import NEWEST_FIRST, Page, cursor_for, paginate
+
+logger = logging.getLogger("app.timeline")
+
+# Authors with more followers than this are not fanned out on write; their
+# posts are merged into followers' feeds at read time instead.
+FANOUT_THRESHOLD = int(os.getenv("TIMELINE_FANOUT_THRESHOLD", "5000"))
+# Maximum number of entries kept in a single user's timeline.
+TIMELINE_MAX_LENGTH = int(os.getenv("TIMELINE_MAX_LENGTH", "800"))
+# Fraction of fan-out inserts that check the follower's timeline length, so
+# a timeline overshoots TIMELINE_MAX_LENGTH by about 1 / sample entries.
+TIMELINE_TRIM_SAMPLE = float(os.getenv("TIMELINE_TRIM_SAMPLE", "0.05"))
+# Number of an author's recent posts copied into a timeline on follow.
+BACKFILL_LIMIT = int(os.getenv("TIMELINE_BACKFILL_LIMIT", "50"))
+# How long the set of pull-mode authors is cached in memory, in seconds.
+PULL_AUTHORS_TTL = float(os.getenv("TIMELINE_PULL_AUTHORS_TTL", "30"))
+
+# Timeline entries share the post's (created_at, _id) ordering so cursors can
+# be used interchangeably with the posts collection.
+TIMELINE_ORDER = [("created_at", -1), ("post_id", -1)]
+FANOUT_BATCH_SIZE = 1000
+
+_pull_authors = {"expires_at": 0.0, "ids": frozenset()}
+
+
+def _entry(user_id, post: dict) -> dict:
+    return {
+        "user_id": user_id,
+        "post_id": post["_id"],
+        "author_id": post["user_id"],
+        "created_at": post["created_at"],
+    }
+
+
+async def _insert_entries(db, entries: list) -> int:
+    inserted = 0
+    for start in range(0, len(entries), FANOUT_BATCH_SIZE):
+        batch = entries[start:start + FANOUT_BATCH_SIZE]
+        try:
+            result = await db.timelines.insert_many(batch, ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate (user_id, post_id) entries are expected on retries and backfills.
+            inserted += e.details.get("nInserted", 0)
+    return inserted
+
+
+def _is_pull_author(author: dict) -> bool:
+    return author.get("fanout_mode") == "pull" or author.get("followers_count", 0) > FANOUT_THRESHOLD
+
+
+async def fan_out_post(db, post: dict, author: dict) -> int:
+    """
+    Pushes a new post into the timelines of the author's followers.
+
+    Authors above FANOUT_THRESHOLD are switched to pull mode instead; their
+    posts are merged in when followers read their feed.
+    """
+    if _is_pull_author(author):
+        if author.get("fanout_mode") != "pull":
+            await db.users.update_one({"_id": author["_id"]}, {"$set": {"fanout_mode": "pull"}})
+            invalidate_cached_user(author["_id"])
+            _pull_authors["expires_at"] = 0.0
+        return 0
+    inserted = 0
+    async for follower_ids in follower_id_batches(db, author["_id"], FANOUT_BATCH_SIZE):
+        inserted += await _insert_entries(db, [_entry(follower_id, post) for follower_id in follower_ids])
+        await trim_timelines(db, follower_ids)
+    logger.info("Fanned out post %s to %s timelines.", post['_id'], inserted)
+    return inserted
+
+
+async def backfill_timeline(db, follower_id, author: dict) -> int:
+    """
+    Copies the author's most recent posts into a new follower's timeline.
+    """
+    if _is_pull_author(author):
+        return 0
+    cursor = db.posts.find({"user_id": author["_id"]}, {"user_id": 1, "created_at": 1})
+    posts = await cursor.sort(NEWEST_FIRST).limit(BACKFILL_LIMIT).to_list(length=BACKFILL_LIMIT)
+    inserted = await _insert_entries(db, [_entry(follower_id, post) for post in posts])
+    await trim_timeline(db, follower_id)
+    return inserted
+
+
+async def remove_author_from_timeline(db, follower_id, author_id) -> int:
+    return await remove_authors_from_timeline(db, follower_id, [author_id])
+
+
+async def remove_authors_from_timeline(db, follower_id, author_ids: list) -> int:
+    result = await db.timelines.delete_many({"user_id": follower_id, "author_id": {"$in": author_ids}})
+    return result.deleted_count
+
+
+async def trim_timeline(db, user_id) -> int:
+    """
+    Drops entries beyond TIMELINE_MAX_LENGTH from a user's timeline.
+    """
+    cursor = db.timelines.find({"user_id": user_id}, {"created_at": 1, "post_id": 1})
+    boundary = await cursor.sort(TIMELINE_ORDER).skip(TIMELINE_MAX_LENGTH).limit(1).to_list(length=1)
+    if not boundary:
+        return 0
+    oldest_kept = boundary[0]
+    result = await db.timelines.delete_many(
+        {
+            "user_id": user_id,
+            "$or": [
+                {"created_at": {"$lt": oldest_kept["created_at"]}},
+                {"created_at": oldest_kept["created_at"], "post_id": {"$lte": oldest_kept["post_id"]}},
+            ],
+        }
+    )
+    return result.deleted_count
+
+
+async def trim_timelines(db, user_ids: list) -> int:
+    """
+    Trims a random TIMELINE_TRIM_SAMPLE fraction of the timelines among
+    `user_ids`. Each check is a single index probe at TIMELINE_MAX_LENGTH,
+    so fan-out cost stays proportional to the sample, not the timelines.
+    """
+    trimmed = 0
+    for user_id in user_ids:
+        if random.random() < TIMELINE_TRIM_SAMPLE:
+            trimmed += await trim_timeline(db, user_id)
+    return trimmed
+
+
+async def _get_pull_authors(db) -> frozenset:
+    now = time.monotonic()
+    if now >= _pull_authors["expires_at"]:
+        # Accounts over the threshold count as pull authors even before their
+        # next post sets fanout_mode, since backfills and rebuilds skip them.
+        cursor = db.users.find(
+            {"$or": [{"fanout_mode": "pull"}, {"followers_count": {"$gt": FANOUT_THRESHOLD}}]}, {"_id": 1}
+        )
+        _pull_authors["ids"] = frozenset([user["_id"] async for user in cursor])
+        _pull_authors["expires_at"] = now + PULL_AUTHORS_TTL
+    return _pull_authors["ids"]
+
+
+def _merge_pages(pages: list, limit: int, reverse: bool, skip: int = 0) -> Page:
+    seen = set()
+    items = []
+    for page in pages:
+        for post in page.items:
+            if post["_id"] not in seen:
+                seen.add(post["_id"])
+                items.append(post)
+    items.sort(key=lambda post: (post["created_at"], post["_id"]), reverse=True)
+    more = len(items) > skip + limit or any(page.has_prev if reverse else page.has_next for page in pages)
+    if reverse:
+        merged = Page(items=items[-limit:], has_next=True, has_prev=more)
+    else:
+        merged = Page(
+            items=items[skip:skip + limit],
+            has_next=more,
+            has_prev=skip > 0 or any(page.has_prev for page in pages),
+        )
+    if merged.items:
+        if merged.has_next:
+            merged.next_cursor = cursor_for(merged.items[-1], NEWEST_FIRST)
+        if merged.has_prev:
+            merged.prev_cursor = cursor_for(merged.items[0], NEWEST_FIRST)
+    return merged
+
+
+async def read_timeline(
+    db,
+    user_id,
+    limit: int,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    skip: int = 0,
+    projection: Optional[dict] = None,
+) -> Page:
+    """
+    Returns one page of a user's home feed: a range scan over the
+    materialized timeline, merged with recent posts from followed pull-mode
+    authors.
+    """
+    pull_author_ids = await _get_pull_authors(db)
+    pull_authors = await followed_among(db, user_id, pull_author_ids)
+    skip = 0 if after or before else skip
+    # An offset applies to the merged feed, so with pull authors both sources
+    # are read from the top and the merged page is sliced.
+    merged_skip = skip if pull_authors else 0
+    entries = await paginate(
+        db.timelines,
+        {"user_id": user_id},
+        limit + merged_skip,
+        sort=TIMELINE_ORDER,
+        after=after,
+        before=before,
+        skip=skip - merged_skip,
+    )
+    post_ids = [entry["post_id"] for entry in entries.items]
+    posts_by_id = {}
+    if post_ids:
+        cursor = db.posts.find({"_id": {"$in": post_ids}}, projection)
+        posts_by_id = {post["_id"]: post async for post in cursor}
+    # Entry cursors hold (created_at, post_id), which match the posts' (created_at, _id).
+    pushed = Page(
+        items=[posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id],
+        has_next=entries.has_next,
+        has_prev=entries.has_prev,
+        next_cursor=entries.next_cursor,
+        prev_cursor=entries.prev_cursor,
+    )
+
+    if not pull_authors:
+        return pushed
+    pulled = await paginate(
+        db.posts,
+        {"user_id": {"$in": pull_authors}},
+        limit + merged_skip,
+        after=after,
+        before=before,
+        projection=projection,
+    )
+    return _merge_pages([pushed, pulled], limit, reverse=bool(before), skip=merged_skip)
+
+
+async def read_feed(
+    db,
+    user,
+    limit: int,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    skip: int = 0,
+    projection: Optional[dict] = None,
+) -> Page:
+    """
+    One page of the home feed for `user`: their timeline if they follow
+    anyone, otherwise their own posts.
+    """
+    if user.following_count:
+        # Read the materialized timeline, merged with followed pull-mode authors
+        return await read_timeline(
+            db, ObjectId(user.id), limit, after=after, before=before, skip=skip, projection=projection
+        )
+    query = {"user_id": ObjectId(user.id)}
+    return await paginate(
+        db.posts, query, limit, after=after, before=before, skip=skip, projection=projection
+    )
+
+
+async def rebuild_timelines(db=None) -> int:
+    """
+    Rebuilds every timeline from the follow graph, e.g. after enabling the
+    timeline on an existing database.
+    """
+    db = db if db is not None else get_database()
+    inserted = 0
+    async for author in db.users.find({"followers_count": {"$gt": 0}}, {"followers_count": 1, "fanout_mode": 1}):
+        if _is_pull_author(author):
+            continue
+        async for follower_ids in follower_id_batches(db, author["_id"]):
+            for follower_id in follower_ids:
+                inserted += await backfill_timeline(db, follower_id, author)
+    logger.info("Rebuilt timelines: %s entries inserted.", inserted)
+    return inserted
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.timeline rebuild")
+    asyncio.run(rebuild_timelines())
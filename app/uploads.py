@@ -0,0 +1,101 @@
+# app/uploads.py
+
+import os
+import hashlib
+import tempfile
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), '..', 'static', 'images')
+IMAGES_URL = "/static/images"
+# Where uploads are written until they are verified. Must be outside the
+# static directory and on the same filesystem as IMAGES_DIR.
+UPLOAD_TMP_DIR = os.getenv(
+    "UPLOAD_TMP_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'uploads_tmp')
+)
+
+# Largest accepted upload, in bytes.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def _extension_for(header: bytes) -> str:
+    """
+    Picks the file extension from the image's signature bytes; the client's
+    filename and content type are not trusted.
+    """
+    if header.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    raise UnsupportedImage()
+
+
+def _copy_to_content_address(source) -> str:
+    """
+    Streams `source` into UPLOAD_TMP_DIR in chunks while hashing it, checks
+    that it is an image, then moves it to IMAGES_DIR/<sha256><extension>.
+    Identical images end up as a single file.
+    """
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    extension = None
+    source.seek(0)
+    fd, temp_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as destination:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if extension is None:
+                    extension = _extension_for(chunk)
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                destination.write(chunk)
+        if extension is None:
+            raise UnsupportedImage()
+        filename = f"{digest.hexdigest()}{extension}"
+        final_path = os.path.join(IMAGES_DIR, filename)
+        if os.path.exists(final_path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, final_path)
+        return filename
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+async def store_upload(upload: UploadFile) -> str:
+    """
+    Saves an uploaded image under its content hash and returns its URL.
+    """
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large.")
+    try:
+        filename = await run_in_threadpool(_copy_to_content_address, upload.file)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Image is too large.")
+    except UnsupportedImage:
+        raise HTTPException(status_code=400, detail="Unsupported image type.")
+    return f"{IMAGES_URL}/{filename}"
@@ -0,0 +1,141 @@
+# app/user_search.py
+
+import sys
+import asyncio
+import logging
+from typing import Optional
+
+from pymongo import UpdateOne
+
+from app.database import get_database
+from app.pagination import Page, decode_cursor, encode_cursor, keyset_filter
+
+logger = logging.getLogger("app.user_search")
+
+NGRAM_SIZE = 3
+USERNAME_ORDER = [("username_lower", 1), ("_id", 1)]
+PROJECTION = {"username": 1, "username_lower": 1}
+MIGRATION_BATCH_SIZE = 1000
+
+
+def username_ngrams(text: str) -> list:
+    return sorted({text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)})
+
+
+def username_search_fields(username: str) -> dict:
+    """
+    Normalized fields stored on every user document for indexed search.
+    """
+    username_lower = username.lower()
+    return {"username_lower": username_lower, "username_ngrams": username_ngrams(username_lower)}
+
+
+def _tiers(term: str) -> list:
+    """
+    Result tiers in rank order: exact match, prefix match, substring match.
+    Each tier is an indexed query plus an optional in-memory filter.
+    """
+    tiers = [
+        ({"username_lower": term}, None),
+        ({"username_lower": {"$gt": term, "$lt": term + "\uffff"}}, None),
+    ]
+    # A shorter term has no n-gram to look up, so substring matches need at
+    # least NGRAM_SIZE characters (as the README and the search page say).
+    if len(term) >= NGRAM_SIZE:
+        # The n-gram index narrows candidates and the range skips the prefix
+        # tier's usernames; the filter drops n-gram false positives.
+        tiers.append((
+            {
+                "username_ngrams": {"$all": username_ngrams(term)},
+                "$or": [
+                    {"username_lower": {"$lt": term}},
+                    {"username_lower": {"$gte": term + "\uffff"}},
+                ],
+            },
+            lambda user: term in user["username_lower"],
+        ))
+    return tiers
+
+
+async def _fetch_tier(db, query: dict, predicate, key: Optional[list], count: int, reverse: bool) -> list:
+    sort = [(name, -direction if reverse else direction) for name, direction in USERNAME_ORDER]
+    batch_size = count if predicate is None else max(count * 4, 50)
+    found = []
+    while len(found) < count:
+        tier_query = query if key is None else {"$and": [query, keyset_filter(USERNAME_ORDER, key, reverse)]}
+        batch = await db.users.find(tier_query, PROJECTION).sort(sort).limit(batch_size).to_list(length=batch_size)
+        found.extend(user for user in batch if predicate is None or predicate(user))
+        if len(batch) < batch_size:
+            break
+        key = [batch[-1]["username_lower"], batch[-1]["_id"]]
+    return found[:count]
+
+
+async def search_usernames(
+    db,
+    q: str,
+    limit: int,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+) -> Page:
+    """
+    Ranked username search: exact, then prefix, then substring matches,
+    each ordered by username. Cursors are (tier, username_lower, _id).
+    """
+    term = q.strip().lower()
+    tiers = _tiers(term)
+    reverse = bool(before)
+    position = decode_cursor(before if reverse else after, 3) if (after or before) else None
+    order = range(len(tiers) - 1, -1, -1) if reverse else range(len(tiers))
+
+    results = []
+    for tier in order:
+        if position is not None and (tier > position[0] if reverse else tier < position[0]):
+            continue
+        key = position[1:] if position is not None and tier == position[0] else None
+        query, predicate = tiers[tier]
+        users = await _fetch_tier(db, query, predicate, key, limit + 1 - len(results), reverse)
+        results.extend((tier, user) for user in users)
+        if len(results) > limit:
+            break
+
+    more = len(results) > limit
+    results = results[:limit]
+    if reverse:
+        results.reverse()
+        page = Page(has_next=True, has_prev=more)
+    else:
+        page = Page(has_next=more, has_prev=position is not None)
+    page.items = [user for _, user in results]
+    if results:
+        if page.has_next:
+            tier, user = results[-1]
+            page.next_cursor = encode_cursor([tier, user["username_lower"], user["_id"]])
+        if page.has_prev:
+            tier, user = results[0]
+            page.prev_cursor = encode_cursor([tier, user["username_lower"], user["_id"]])
+    return page
+
+
+async def backfill_username_search(db=None) -> int:
+    """
+    Adds username_lower / username_ngrams to users created before indexed search.
+    """
+    db = db if db is not None else get_database()
+    updated = 0
+    operations = []
+    async for user in db.users.find({"username_lower": {"$exists": False}}, {"username": 1}):
+        operations.append(UpdateOne({"_id": user["_id"]}, {"$set": username_search_fields(user["username"])}))
+        if len(operations) >= MIGRATION_BATCH_SIZE:
+            updated += (await db.users.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    if operations:
+        updated += (await db.users.bulk_write(operations, ordered=False)).modified_count
+    logger.info("Added username search fields to %s users.", updated)
+    return updated
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("usage: python -m app.user_search backfill")
+    asyncio.run(backfill_username_search())
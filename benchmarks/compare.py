@@ -0,0 +1,40 @@
+# benchmarks/compare.py
+
+import sys
+import json
+
+# Changes smaller than this fraction are shown without a marker.
+NOISE = 0.05
+
+
+def _change(before: float, after: float) -> str:
+    if not before:
+        return "" if not after else "  new"
+    delta = (after - before) / before
+    marker = "  worse" if delta > NOISE else "  better" if delta < -NOISE else ""
+    return f"{delta:+7.1%}{marker}"
+
+
+def compare(before: dict, after: dict):
+    """
+    Prints p50/p99 latency and queries per request for every route found in
+    both benchmark results.
+    """
+    print(f"{(before['commit'] or '?')[:12]} -> {(after['commit'] or '?')[:12]}")
+    if before["dataset"]["params"] != after["dataset"]["params"]:
+        print("warning: the runs used different datasets")
+    for name in [name for name in after["routes"] if name in before["routes"]]:
+        old, new = before["routes"][name], after["routes"][name]
+        print(f"{name}")
+        for label, key in (("p50 ms", "p50"), ("p99 ms", "p99")):
+            a, b = old["latency_ms"][key], new["latency_ms"][key]
+            print(f"  {label:10} {a:10.2f} {b:10.2f} {_change(a, b)}")
+        a, b = old["queries_per_request"]["mean"], new["queries_per_request"]["mean"]
+        print(f"  {'queries':10} {a:10.2f} {b:10.2f} {_change(a, b)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m benchmarks.compare BEFORE.json AFTER.json")
+    with open(sys.argv[1]) as f_before, open(sys.argv[2]) as f_after:
+        compare(json.load(f_before), json.load(f_after))
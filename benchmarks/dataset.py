@@ -0,0 +1,241 @@
+# benchmarks/dataset.py
+
+import os
+import sys
+import time
+import heapq
+import random
+import asyncio
+import argparse
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import bcrypt
+from bson import ObjectId
+from pymongo import MongoClient
+
+# Benchmarks never touch the app's own database unless told to.
+BENCH_DATABASE = os.getenv("BENCH_DATABASE", "instapy_bench")
+BENCH_PASSWORD = "benchmark"
+LOAD_BATCH_SIZE = 10000
+# Posts are spread over this many days before the generation time.
+POST_DAYS = 90
+HASHTAG_VOCABULARY = 5000
+CATEGORIES = ["travel", "food", "fashion", "fitness", "art", "music", "pets", "tech", "nature", "sports"]
+WORDS = ["sunset", "coffee", "weekend", "friends", "city", "beach", "morning", "vibes", "today", "love"]
+# Ids of the users, posts and hashtags the runner requests, drawn like real
+# traffic: popular accounts and hashtags more often.
+SAMPLE_SIZE = 1000
+
+
+class Zipf:
+    """
+    Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s.
+    """
+
+    def __init__(self, n: int, s: float):
+        self.cumulative = list(accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+    def draw(self, rng: random.Random) -> int:
+        return bisect(self.cumulative, rng.random() * self.cumulative[-1])
+
+
+def _power_law(rng: random.Random, minimum: int, alpha: float, cap: int) -> int:
+    return min(cap, int(minimum * rng.paretovariate(alpha)))
+
+
+def _object_id(rng: random.Random) -> ObjectId:
+    # Seeded, so the same parameters give the same ids on every load.
+    return ObjectId(rng.randbytes(12))
+
+
+def generate(users: int, posts: int, likes_per_post: float, comments_per_post: float, seed: int):
+    """
+    Yields the dataset as (collection, documents) batches shaped like the
+    app's own documents: users with power-law follower counts and the cached
+    counts, follow edges, posts with hashtags and categories, likes,
+    comments and the materialized timelines fan-out would have built. The
+    last item is ("sample", ids) for the runner.
+    """
+    from app.timeline import FANOUT_THRESHOLD, TIMELINE_MAX_LENGTH
+    from app.user_search import username_search_fields
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    password = bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode()
+
+    user_ids = [_object_id(rng) for _ in range(users)]
+    user_docs = []
+    for index, user_id in enumerate(user_ids):
+        username = f"user{index:06d}"
+        user_docs.append({
+            "_id": user_id,
+            "username": username,
+            "email": f"{username}@bench.example",
+            "password": password,
+            **username_search_fields(username),
+            "following_count": 0,
+            "followers_count": 0,
+        })
+
+    # Follower counts follow a Pareto distribution, so a few accounts have
+    # thousands of followers (and switch to pull mode) and most have a handful.
+    following = [[] for _ in range(users)]
+    follows = []
+    for index, user_id in enumerate(user_ids):
+        count = _power_law(rng, 3, 1.2, users - 1)
+        followers = [follower for follower in rng.sample(range(users), count + 1) if follower != index][:count]
+        user_docs[index]["followers_count"] = len(followers)
+        for follower in followers:
+            following[follower].append(index)
+            follows.append({"follower_id": user_ids[follower], "followee_id": user_id, "created_at": now})
+        if len(follows) >= LOAD_BATCH_SIZE:
+            yield "follows", follows
+            follows = []
+    yield "follows", follows
+    for index in range(users):
+        user_docs[index]["following_count"] = len(following[index])
+        # What fan_out_post records for authors over the threshold.
+        if user_docs[index]["followers_count"] > FANOUT_THRESHOLD:
+            user_docs[index]["fanout_mode"] = "pull"
+    yield "users", user_docs
+
+    tags = Zipf(HASHTAG_VOCABULARY, 1.1)
+    # Popular accounts post more; weights grow with the square root of followers.
+    author_weights = list(accumulate((user["followers_count"] + 1) ** 0.5 for user in user_docs))
+    posts_by_author = [[] for _ in range(users)]
+    post_ids = []
+    span = POST_DAYS * 24 * 3600
+    batch = {"posts": [], "likes": [], "comments": []}
+    for _ in range(posts):
+        author = bisect(author_weights, rng.random() * author_weights[-1])
+        hashtags = sorted({f"tag{tags.draw(rng)}" for _ in range(rng.randint(0, 5))})
+        caption = " ".join(rng.choices(WORDS, k=rng.randint(2, 8)) + [f"#{tag}" for tag in hashtags])
+        post_id = _object_id(rng)
+        created_at = now - timedelta(seconds=rng.randrange(span))
+        like_count = min(users, int(rng.expovariate(1 / likes_per_post))) if likes_per_post else 0
+        for liker in rng.sample(range(users), like_count):
+            batch["likes"].append({"post_id": post_id, "user_id": user_ids[liker], "created_at": created_at})
+        comment_count = int(rng.expovariate(1 / comments_per_post)) if comments_per_post else 0
+        for _ in range(comment_count):
+            batch["comments"].append({
+                "text": " ".join(rng.choices(WORDS, k=rng.randint(1, 6))),
+                "user_id": user_ids[rng.randrange(users)],
+                "post_id": post_id,
+                "created_at": created_at,
+            })
+        batch["posts"].append({
+            "_id": post_id,
+            "caption": caption,
+            "image_url": "/static/images/benchmark.jpg",
+            "category": rng.choice(CATEGORIES),
+            "hashtags": hashtags,
+            "user_id": user_ids[author],
+            "created_at": created_at,
+            "likes_count": like_count,
+            "comments_count": comment_count,
+        })
+        posts_by_author[author].append((created_at, post_id))
+        post_ids.append(post_id)
+        for name, documents in batch.items():
+            if len(documents) >= LOAD_BATCH_SIZE:
+                yield name, documents
+                batch[name] = []
+    for name, documents in batch.items():
+        yield name, documents
+
+    # Timelines hold the newest posts of every push-mode account followed,
+    # capped like trim_timeline() does.
+    timelines = []
+    for index in range(users):
+        candidates = (
+            (created_at, post_id, followee)
+            for followee in following[index]
+            if user_docs[followee]["followers_count"] <= FANOUT_THRESHOLD
+            for created_at, post_id in posts_by_author[followee]
+        )
+        for created_at, post_id, followee in heapq.nlargest(TIMELINE_MAX_LENGTH, candidates):
+            timelines.append({
+                "user_id": user_ids[index],
+                "post_id": post_id,
+                "author_id": user_ids[followee],
+                "created_at": created_at,
+            })
+        if len(timelines) >= LOAD_BATCH_SIZE:
+            yield "timelines", timelines
+            timelines = []
+    yield "timelines", timelines
+
+    popular = sorted(range(users), key=lambda index: user_docs[index]["followers_count"], reverse=True)
+    popularity = Zipf(users, 1.0)
+    yield "sample", {
+        # Viewers are ordinary accounts; profiles skew towards the biggest.
+        "viewer_ids": [user_ids[rng.randrange(users)] for _ in range(SAMPLE_SIZE)],
+        "profile_ids": [user_ids[popular[popularity.draw(rng)]] for _ in range(SAMPLE_SIZE)],
+        "post_ids": [post_ids[rng.randrange(posts)] for _ in range(SAMPLE_SIZE)],
+        "hashtags": [f"tag{tags.draw(rng)}" for _ in range(SAMPLE_SIZE)],
+        "username_queries": [f"user{rng.randrange(users):06d}"[:rng.randint(5, 10)] for _ in range(SAMPLE_SIZE)],
+    }
+
+
+def load(mongo_uri: str, database: str, params: dict) -> dict:
+    """
+    Replaces `database` with a generated dataset and applies the app's index
+    manifest. Returns the document counts.
+    """
+    from app.database import INDEX_MANIFEST, manifest_version
+
+    started = time.perf_counter()
+    client = MongoClient(mongo_uri)
+    client.drop_database(database)
+    db = client[database]
+    counts = {}
+    sample = None
+    for name, documents in generate(**params):
+        if name == "sample":
+            sample = documents
+        elif documents:
+            db[name].insert_many(documents, ordered=False)
+            counts[name] = counts.get(name, 0) + len(documents)
+    for name, indexes in INDEX_MANIFEST.items():
+        db[name].create_indexes(indexes)
+    db.meta.insert_many([
+        {"_id": "indexes", "version": manifest_version(), "applied_at": datetime.utcnow()},
+        {"_id": "benchmark_dataset", "params": params, "counts": counts, "sample": sample, "loaded_at": datetime.utcnow()},
+    ])
+    client.close()
+
+    # Hashtag statistics come from the app's own rebuild job.
+    from app import database as app_database
+    from app.hashtags import rebuild_hashtag_stats
+
+    app_database.DATABASE_NAME = database
+    asyncio.run(rebuild_hashtag_stats())
+    print(f"Loaded {counts} in {time.perf_counter() - started:.1f}s.")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a synthetic social graph into a local mongod.")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--likes-per-post", type=float, default=5.0)
+    parser.add_argument("--comments-per-post", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", default=BENCH_DATABASE)
+    args = parser.parse_args()
+    if args.users < 2 or args.posts < 1:
+        sys.exit("need at least 2 users and 1 post")
+    params = {
+        "users": args.users,
+        "posts": args.posts,
+        "likes_per_post": args.likes_per_post,
+        "comments_per_post": args.comments_per_post,
+        "seed": args.seed,
+    }
+    load(os.getenv("MONGO_URI", "mongodb://localhost:27017"), args.database, params)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# benchmarks/run.py
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import platform
+import subprocess
+from datetime import datetime, timedelta
+
+from benchmarks.dataset import BENCH_DATABASE
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+WARMUP_REQUESTS = 10
+
+# Route name -> (method, URL template). Placeholders are filled from the
+# sample ids stored with the dataset: {post_id}, {user_id}, {hashtag}, {q},
+# and from the viewer's own first feed page: {next_cursor}.
+SCENARIOS = {
+    "feed": ("GET", "/feed"),
+    "feed_page_2": ("GET", "/feed?after={next_cursor}"),
+    "posts": ("GET", "/posts/"),
+    "profile": ("GET", "/profile/{user_id}"),
+    "search_posts": ("GET", "/search_posts?hashtag={hashtag}"),
+    "search_users": ("GET", "/search_users?q={q}"),
+    "post_likes": ("GET", "/posts/{post_id}/likes"),
+    "post_comments": ("GET", "/posts/{post_id}/comments"),
+    "hashtag_autocomplete": ("GET", "/hashtags/autocomplete?q={hashtag_prefix}"),
+    "top_hashtags": ("GET", "/hashtags/top?window=24h"),
+    "api_feed": ("GET", "/api/v1/feed"),
+    "api_posts": ("GET", "/api/v1/posts"),
+    "api_post": ("GET", "/api/v1/posts/{post_id}"),
+    "api_post_comments": ("GET", "/api/v1/posts/{post_id}/comments"),
+    "api_like": ("POST", "/api/v1/posts/{post_id}/like"),
+}
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def git_commit() -> dict:
+    def git(*args):
+        result = subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def _fill(template: str, sample: dict, rng: random.Random, next_cursor: str = None) -> str:
+    hashtag = rng.choice(sample["hashtags"])
+    return template.format(
+        next_cursor=next_cursor,
+        post_id=rng.choice(sample["post_ids"]),
+        user_id=rng.choice(sample["profile_ids"]),
+        hashtag=hashtag,
+        hashtag_prefix=hashtag[:rng.randint(1, len(hashtag))],
+        q=rng.choice(sample["username_queries"]),
+    )
+
+
+async def feed_cursors(client, tokens: list) -> dict:
+    """
+    Each viewer's cursor to the second page of their feed, for viewers
+    whose feed has one.
+    """
+    cursors = {}
+    for token in dict.fromkeys(tokens):
+        response = await client.get("/api/v1/feed?fields=id", headers={"Authorization": f"Bearer {token}"})
+        cursor = response.json().get("next_cursor") if response.status_code == 200 else None
+        if cursor:
+            cursors[token] = cursor
+    return cursors
+
+
+async def run_scenario(client, method: str, template: str, sample: dict, tokens: list, requests: int, concurrency: int, seed: int, cursors: dict) -> dict:
+    rng = random.Random(seed)
+    if "{next_cursor}" in template:
+        tokens = [token for token in tokens if token in cursors]
+        if not tokens:
+            sys.exit("No viewer in the sample has a second feed page; load a larger dataset.")
+    calls = []
+    for _ in range(requests + WARMUP_REQUESTS):
+        token = rng.choice(tokens)
+        calls.append((_fill(template, sample, rng, cursors.get(token)), token))
+    latencies = []
+    commands = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(url: str, token: str, record: bool):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, url, headers={"Authorization": f"Bearer {token}"})
+            elapsed = time.perf_counter() - started
+        if record:
+            latencies.append(elapsed * 1000)
+            commands.append(int(response.headers.get("x-mongo-commands", 0)))
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    for url, token in calls[:WARMUP_REQUESTS]:
+        await call(url, token, record=False)
+    started = time.perf_counter()
+    await asyncio.gather(*(call(url, token, record=True) for url, token in calls[WARMUP_REQUESTS:]))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    commands.sort()
+    return {
+        "method": method,
+        "path": template,
+        "requests": requests,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(requests / wall, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p90": round(percentile(latencies, 0.90), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3),
+            "mean": round(sum(latencies) / len(latencies), 3),
+        },
+        "queries_per_request": {
+            "mean": round(sum(commands) / len(commands), 2),
+            "p50": percentile(commands, 0.50),
+            "max": commands[-1],
+        },
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+    from app import app, database, metrics
+    from app.auth import create_access_token
+    from app.database import get_database
+
+    # The benchmark database, per-request command counts in a response
+    # header, and no budget warnings mixed into the output.
+    database.DATABASE_NAME = args.database
+    metrics.MONGO_COMMAND_HEADER = True
+    metrics.QUERY_BUDGET_MODE = "off"
+
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    await app.router.startup()
+    try:
+        dataset = await get_database().meta.find_one({"_id": "benchmark_dataset"})
+        if dataset is None:
+            sys.exit(f"No benchmark dataset in '{args.database}'; run 'python -m benchmarks.dataset' first.")
+        sample = dataset["sample"]
+        # Tokens are minted directly so bcrypt doesn't dominate the numbers.
+        tokens = [
+            create_access_token({"sub": str(user_id)}, expires_delta=timedelta(hours=1))
+            for user_id in sample["viewer_ids"]
+        ]
+        names = args.routes.split(",") if args.routes else list(SCENARIOS)
+        results = {}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            needs_cursors = any("{next_cursor}" in SCENARIOS[name][1] for name in names)
+            cursors = await feed_cursors(client, tokens) if needs_cursors else {}
+            for index, name in enumerate(names):
+                method, template = SCENARIOS[name]
+                results[name] = await run_scenario(
+                    client, method, template, sample, tokens, args.requests, args.concurrency, args.seed + index, cursors
+                )
+                latency = results[name]["latency_ms"]
+                print(
+                    f"{name:22} p50 {latency['p50']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+                    f"queries {results[name]['queries_per_request']['mean']:6.2f}",
+                    file=sys.stderr,
+                )
+    finally:
+        await app.router.shutdown()
+    return {
+        **git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "dataset": {"params": dataset["params"], "counts": dataset["counts"]},
+        "settings": {"requests": args.requests, "concurrency": args.concurrency, "seed": args.seed},
+        "routes": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-route latency and queries per request in-process.")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per route")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--routes", help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--database", default=BENCH_DATABASE)
+    parser.add_argument("--output", help="Where to write the JSON results (default benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+    if args.routes and not set(args.routes.split(",")) <= set(SCENARIOS):
+        sys.exit(f"Unknown routes: {', '.join(set(args.routes.split(',')) - set(SCENARIOS))}")
+
+    report = asyncio.run(run(args))
+    output = args.output or os.path.join(RESULTS_DIR, f"{(report['commit'] or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Wrote {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
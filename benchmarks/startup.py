@@ -0,0 +1,96 @@
+# benchmarks/startup.py
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Packages the web workers must never import while starting up.
+HEAVY_MODULES = {"altair", "pandas", "numpy", "scipy", "matplotlib", "PIL"}
+# A worker should be ready well within this many seconds of being spawned.
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "1.0"))
+TOP_IMPORTS = 15
+
+# Runs in a fresh interpreter: imports the app, then runs its startup hooks
+# (connect and warm the pool, sync indexes, replay journals) and shutdown.
+PROBE = """
+import json, time, asyncio
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+
+async def main():
+    await app.router.startup()
+    ready = time.perf_counter()
+    await app.router.shutdown()
+    return ready
+
+ready = asyncio.run(main())
+print(json.dumps({"import_seconds": imported - started, "startup_seconds": ready - imported}))
+"""
+
+
+def import_audit() -> dict:
+    """
+    Imports the app under `python -X importtime` and reports the slowest
+    modules and any heavy package that got pulled in.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header row
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    app_cumulative = next(cumulative for name, _, cumulative in modules if name == "app")
+    heavy = sorted({name.split(".")[0] for name, _, _ in modules} & HEAVY_MODULES)
+    slowest = sorted(modules, key=lambda module: module[1], reverse=True)[:TOP_IMPORTS]
+    return {
+        "import_seconds": app_cumulative / 1e6,
+        "modules": len(modules),
+        "heavy_modules": heavy,
+        "slowest_self_ms": {name: round(self_us / 1000, 2) for name, self_us, _ in slowest},
+    }
+
+
+def startup_run() -> dict:
+    spawned = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_seconds"] = time.perf_counter() - spawned
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure worker import and startup time.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh worker starts to measure")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {"audit": import_audit(), "runs": [startup_run() for _ in range(args.runs)]}
+    for key in ("import_seconds", "startup_seconds", "process_seconds"):
+        report[f"median_{key}"] = statistics.median(run[key] for run in report["runs"])
+    report["budget_seconds"] = STARTUP_BUDGET
+    report["ok"] = not report["audit"]["heavy_modules"] and report["median_process_seconds"] < STARTUP_BUDGET
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()